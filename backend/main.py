@@ -1,13 +1,31 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Header
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import JSONResponse, StreamingResponse
+from fastapi.encoders import jsonable_encoder
+import orjson
 import yfinance as yf
 import pandas as pd
 import numpy as np
 import os
-import requests
+import httpx
 import json
 from dotenv import load_dotenv
 import pathlib
+import glob
+import hmac
+import logging
+import pickle
+import threading
+import time
+import math
+import asyncio
+import contextlib
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+logging.basicConfig(level=os.environ.get("LOG_LEVEL", "WARNING").upper())
+logger = logging.getLogger(__name__)
 
 # Load .env from the project root (one level up from backend/)
 env_path = pathlib.Path(__file__).parent.parent / '.env'
@@ -17,7 +35,31 @@ load_dotenv(dotenv_path=env_path)
 if os.environ.get('VERCEL'):
     os.environ['XDG_CACHE_HOME'] = '/tmp'
 
-app = FastAPI()
+class ORJSONResponse(JSONResponse):
+    """
+    JSON response serialized by orjson in C. Numpy scalars/arrays are written natively
+    and NaN/Infinity become null; anything else orjson can't handle goes through
+    FastAPI's jsonable_encoder.
+    """
+    def render(self, content):
+        return orjson.dumps(
+            content,
+            default=jsonable_encoder,
+            option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NAIVE_UTC
+        )
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    # One pooled Gemini client for the server's loop, closed on shutdown
+    app.state.gemini_loop = asyncio.get_running_loop()
+    app.state.gemini_client = httpx.AsyncClient(**GEMINI_CLIENT_OPTIONS)
+    try:
+        yield
+    finally:
+        client, app.state.gemini_client = app.state.gemini_client, None
+        await client.aclose()
+
+app = FastAPI(default_response_class=ORJSONResponse, lifespan=lifespan)
 
 # Configure CORS
 app.add_middleware(
@@ -28,14 +70,341 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-def get_validated_support_levels(ticker: str):
+# Chart and stock payloads are large, repetitive JSON; gzip shrinks them several times over
+app.add_middleware(GZipMiddleware, minimum_size=1024)
+
+# --- Data Cache ---
+# yfinance calls are slow network round trips, so fetched objects are cached by
+# "<field>:<TICKER>[:<period>]". Uses Redis when REDIS_URL is set (shared across
+# serverless instances), otherwise a small in-process TTL cache.
+# This stands in for an HTTP-level cache: yfinance rejects caching sessions such as
+# requests_cache, and already shares one keep-alive curl_cffi session across Tickers.
+REDIS_URL = os.environ.get("REDIS_URL")
+redis_client = None
+if REDIS_URL:
+    try:
+        import redis
+        redis_client = redis.Redis.from_url(REDIS_URL)
+    except ImportError:
+        logger.warning("REDIS_URL is set but the redis package is not installed, using in-process cache")
+
+LOCAL_CACHE_MAXSIZE = 256
+_local_cache = OrderedDict()  # key -> (expires_at, value)
+_local_cache_lock = threading.Lock()
+cache_stats = {"hits": 0, "misses": 0}
+# Per-key locks so concurrent misses on one key load it once: key -> [lock, threads using it]
+_fetch_locks = {}
+_fetch_locks_lock = threading.Lock()
+
+def cache_get(key):
+    """Return (hit, value) for a cache key"""
+    if redis_client is not None:
+        try:
+            raw = redis_client.get(key)
+            if raw is not None:
+                return True, pickle.loads(raw)
+        except Exception as e:
+            logger.warning("Redis get failed for %s: %s", key, e)
+        return False, None
+
+    with _local_cache_lock:
+        entry = _local_cache.get(key)
+        if entry is None:
+            return False, None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del _local_cache[key]
+            return False, None
+        _local_cache.move_to_end(key)
+        return True, value
+
+def cache_set(key, value, ttl):
+    if redis_client is not None:
+        try:
+            redis_client.setex(key, ttl, pickle.dumps(value))
+        except Exception as e:
+            logger.warning("Redis set failed for %s: %s", key, e)
+        return
+
+    with _local_cache_lock:
+        _local_cache[key] = (time.monotonic() + ttl, value)
+        _local_cache.move_to_end(key)
+        while len(_local_cache) > LOCAL_CACHE_MAXSIZE:
+            _local_cache.popitem(last=False)
+
+def cached_fetch(key, ttl, loader, cache_if=None):
+    """Return the cached value for key, calling loader() and caching its result on a miss.
+    cache_if(value) can veto caching (e.g. error results).
+    In-process hits return the same object, so callers should treat it as read-only.
+    Concurrent misses on the same key in this process wait for one loader() call
+    instead of all hitting Yahoo (a vetoed result is not shared, the next waiter loads again)."""
+    def cached():
+        hit, value = cache_get(key)
+        if hit:
+            cache_stats["hits"] += 1
+            logger.debug("Cache hit %s (hits=%d, misses=%d)", key, cache_stats["hits"], cache_stats["misses"])
+        return hit, value
+
+    hit, value = cached()
+    if hit:
+        return value
+
+    with _fetch_locks_lock:
+        entry = _fetch_locks.setdefault(key, [threading.Lock(), 0])
+        entry[1] += 1
+    try:
+        with entry[0]:
+            # Another thread may have loaded the key while this one waited
+            hit, value = cached()
+            if hit:
+                return value
+
+            cache_stats["misses"] += 1
+            logger.debug("Cache miss %s (hits=%d, misses=%d)", key, cache_stats["hits"], cache_stats["misses"])
+            value = loader()
+            if cache_if is None or cache_if(value):
+                cache_set(key, value, ttl)
+            return value
+    finally:
+        with _fetch_locks_lock:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del _fetch_locks[key]
+
+def cache_invalidate_ticker(symbol):
+    """Drop every cached entry for a ticker, returns the number of keys removed"""
+    def matches(key):
+        parts = key.split(":")
+        return len(parts) > 1 and parts[1] == symbol
+
+    if redis_client is not None:
+        keys = [k for k in redis_client.scan_iter(match=f"*:{symbol}*") if matches(k.decode())]
+        if keys:
+            redis_client.delete(*keys)
+        return len(keys)
+
+    with _local_cache_lock:
+        keys = [k for k in _local_cache if matches(k)]
+        for k in keys:
+            del _local_cache[k]
+        return len(keys)
+
+# TTLs (seconds) for cached yfinance data
+INFO_TTL = 900            # Quotes inside info move intraday
+STATEMENT_TTL = 6 * 3600  # Annual/quarterly statements rarely change
+HISTORY_TTL = 3600
+NEWS_TTL = 300            # Headlines and 15m bars change within minutes
+INTRADAY_TTL = 300
+DAILY_TTL = 24 * 3600     # Per-day derived results (valuation, support levels)
+# Chart bars go stale as fast as their interval
+CHART_TTL = {"1m": 30, "5m": 60, "30m": 300, "1h": 600, "1d": 3600, "1wk": 3600, "1mo": 86400}
+
+# Moat evaluations are kept per ticker per day, in the cache and as JSON files on disk
+# so a restart doesn't pay for them again (XDG_CACHE_HOME is /tmp on Vercel)
+MOAT_CACHE_DIR = pathlib.Path(os.environ.get("XDG_CACHE_HOME") or pathlib.Path.home() / ".cache") / "stock-analyser" / "moat"
+
+def load_moat_evaluation(symbol, date):
+    """Cached evaluation for the day, falling back to the disk copy; None if there is none"""
+    key = f"moat:{symbol}:{date}"
+    hit, evaluation = cache_get(key)
+    if hit:
+        return evaluation
+    try:
+        evaluation = orjson.loads((MOAT_CACHE_DIR / f"{symbol}_{date}.json").read_bytes())
+    except (OSError, orjson.JSONDecodeError):
+        return None
+    cache_set(key, evaluation, DAILY_TTL)
+    return evaluation
+
+def store_moat_evaluation(symbol, date, evaluation):
+    """Cache an evaluation for the day and write its disk copy, returns the evaluation"""
+    cache_set(f"moat:{symbol}:{date}", evaluation, DAILY_TTL)
+    try:
+        MOAT_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        path = MOAT_CACHE_DIR / f"{symbol}_{date}.json"
+        tmp_path = path.with_suffix(".tmp")
+        tmp_path.write_bytes(orjson.dumps(evaluation))
+        tmp_path.replace(path) # Atomic, readers never see a partial file
+    except OSError:
+        logger.warning("Writing moat cache for %s failed", symbol, exc_info=True)
+    return evaluation
+
+# Daily history returned with /api/stock. The 20Y trend check and the frontend's
+# 20Y moat chart are the longest consumers, so nothing older is downloaded.
+HISTORY_PERIOD = "20y"
+
+# --- Concurrent Fetching ---
+# Yahoo requests are independent and I/O bound, so they run on a shared thread
+# pool. The semaphore caps in-flight requests to stay under Yahoo's rate limit.
+yahoo_executor = ThreadPoolExecutor(max_workers=12)
+yahoo_semaphore = threading.BoundedSemaphore(4)
+
+def is_cacheable_fetch(value):
+    # A failed yfinance fetch returns an empty frame instead of raising, don't keep it for the whole TTL
+    return value is not None and not getattr(value, "empty", False)
+
+def submit_fetch(key, ttl, loader):
+    """Run cached_fetch on the Yahoo thread pool and return its Future"""
+    def throttled_loader():
+        with yahoo_semaphore:
+            return loader()
+    return yahoo_executor.submit(cached_fetch, key, ttl, throttled_loader, is_cacheable_fetch)
+
+# Discount rate by beta bucket: a beta below edges[i] (and at or above edges[i-1]) uses rates[i]
+# US: 5.4% (< 0.85, incl. < 0.8) stepping 0.3% per 0.1 beta up to 7.8% (>= 1.55)
+# "More than 7.8" in the original spec is read as a typo for "more than 1.5"
+DISCOUNT_BETA_EDGES_US = np.array([0.85, 0.95, 1.05, 1.15, 1.25, 1.35, 1.45, 1.55])
+DISCOUNT_RATES_US = np.array([0.054, 0.057, 0.060, 0.063, 0.066, 0.069, 0.072, 0.075, 0.078])
+# China: 8.5% (< 0.85, incl. < 0.8) up to 13.7% (~1.5), 14.5% for beta >= 1.6
+DISCOUNT_BETA_EDGES_CN = np.array([0.85, 0.95, 1.05, 1.15, 1.25, 1.35, 1.45, 1.6])
+DISCOUNT_RATES_CN = np.array([0.085, 0.093, 0.100, 0.108, 0.115, 0.122, 0.130, 0.137, 0.145])
+
+def cagr(series, min_points=3):
+    """
+    Per-period growth rate from the oldest to the newest value of a newest-first series.
+    Returns None with fewer than min_points values or a zero/NaN endpoint.
+    """
+    values = np.asarray(series, dtype=float)
+    if values.size < min_points:
+        return None
+    newest, oldest = values[0], values[-1]
+    if not (np.isfinite(newest) and np.isfinite(oldest)) or oldest == 0:
+        return None
+    return (newest / abs(oldest)) ** (1 / values.size) - 1
+
+def trend_passes(y, trend_type, tolerance):
+    """
+    Trend test on a short chronological (Oldest -> Newest) list of floats without NaN.
+    Statement series hold a handful of years, where scalar Python beats numpy dispatch.
+    """
+    n = len(y)
+    if n < 2: return False
+    newest = y[-1]
+    oldest = y[0]
+
+    def slope():
+        # Closed-form least-squares slope of y over x = 0..n-1 (same as np.polyfit degree 1)
+        x_mean = (n - 1) / 2
+        y_mean = sum(y) / n
+        return sum((i - x_mean) * (v - y_mean) for i, v in enumerate(y)) / (n * (n * n - 1) / 12)
+
+    if trend_type == "increasing":
+        # 1. Overall Increase (Newest > Oldest)
+        if newest > oldest: return True
+
+        # 2. Linear Regression Slope (Check if generally trending up)
+        if slope() > 0: return True
+
+        # 3. Consistent Increase (Year over Year)
+        # Allow tolerance fluctuation
+        return all(curr >= prev * (1 - tolerance) for prev, curr in zip(y, y[1:]))
+
+    elif trend_type == "stable_increasing":
+        # Pass if Newest >= Oldest * (1 - tolerance)
+        if newest >= oldest * (1 - tolerance): return True
+
+        # Check Slope for "Stable/Increasing"
+        return slope() >= 0 # Positive or flat slope
+
+    elif trend_type == "reducing_stable":
+        # Pass if Newest <= Oldest * (1 + tolerance)
+        if newest <= oldest * (1 + tolerance): return True
+
+        # Check Slope (should be negative or zero)
+        return slope() <= 0
+
+    return False
+
+def rolling_smas(close, periods, dtype=float):
+    """Simple moving averages of a close array for several windows from one prefix sum.
+    Matches pandas rolling(window).mean(): a window containing NaN yields NaN.
+    The prefix sum is always float64; dtype only sets the precision the SMAs are stored in."""
+    close = np.asarray(close, dtype=float)
+    nan_mask = np.isnan(close)
+    has_nans = nan_mask.any()
+    csum = np.empty(len(close) + 1)
+    csum[0] = 0.0
+    np.cumsum(np.where(nan_mask, 0.0, close) if has_nans else close, out=csum[1:])
+    if has_nans:
+        nan_count = np.concatenate(([0], np.cumsum(nan_mask)))
+
+    # One preallocated block for every window; each SMA is a row view into it
+    out = np.full((len(periods), len(close)), np.nan, dtype=dtype)
+    smas = {}
+    for sma, period in zip(out, periods):
+        if len(close) >= period:
+            # Window sums are written straight into the output, no temporaries per window
+            window = sma[period - 1:]
+            np.subtract(csum[period:], csum[:-period], out=window)
+            window /= period
+            if has_nans:
+                window[(nan_count[period:] - nan_count[:-period]) > 0] = np.nan
+        smas[period] = sma
+    return smas
+
+def format_dates(index, with_time=False):
+    """
+    Wall-clock "%Y-%m-%d" (or "%Y-%m-%d %H:%M") strings for a DatetimeIndex.
+    numpy's datetime_as_string runs in C, unlike DatetimeIndex.strftime which
+    formats element by element.
+    """
+    if len(index) == 0:
+        # yfinance's empty frame for a failed fetch has a plain Index, without tz
+        return []
+    values = (index.tz_localize(None) if index.tz is not None else index).values
+    if with_time:
+        return [s.replace("T", " ") for s in np.datetime_as_string(values, unit="m").tolist()]
+    return np.datetime_as_string(values, unit="D").tolist()
+
+def close_records(hist, with_time=False):
+    """[{"date", "close"}] rows for a price history, skipping bars without a close"""
+    dates = format_dates(hist.index, with_time)
+    closes = hist["Close"].to_numpy(dtype=float).tolist()
+    # close == close is False only for NaN
+    return [{"date": date, "close": close} for date, close in zip(dates, closes) if close == close]
+
+OHLCV_AGG = {"Open": "first", "High": "max", "Low": "min", "Close": "last", "Volume": "sum"}
+
+def resample_ohlcv(df, rule, **kwargs):
+    """Aggregate daily OHLCV bars into weekly/monthly bars (kwargs go to DataFrame.resample)"""
+    agg = {col: how for col, how in OHLCV_AGG.items() if col in df.columns}
+    return df.resample(rule, **kwargs).agg(agg).dropna(subset=["Close"])
+
+# Resampling that reproduces Yahoo's own bars: weeks start (and are labelled) on Monday,
+# months on the 1st
+YAHOO_BAR_RESAMPLE = {
+    "1wk": {"rule": "W-MON", "label": "left", "closed": "left"},
+    "1mo": {"rule": "MS"},
+}
+
+def get_full_history(ticker):
+    """Daily bars since listing, cached per ticker; the daily/weekly/monthly charts are cut from it"""
+    symbol = ticker.upper()
+    return cached_fetch(
+        f"history:{symbol}:max:1d", HISTORY_TTL,
+        lambda: yf.Ticker(symbol).history(period="max", interval="1d"),
+        cache_if=is_cacheable_fetch
+    )
+
+def get_validated_support_levels(ticker: str, daily=None):
+    """daily: optional daily history covering at least 10 years, reused instead of fetching"""
     try:
-        stock = yf.Ticker(ticker)
-        
         # 1. Fetch Data
-        hist_10y_mo = stock.history(period="10y", interval="1mo")
-        hist_5y_wk = stock.history(period="5y", interval="1wk")
-        hist_1y_d = stock.history(period="1y", interval="1d")
+        # One daily download; the weekly and monthly views are resampled from it locally
+        if daily is None:
+            stock = yf.Ticker(ticker)
+            daily = cached_fetch(
+                f"history:{ticker.upper()}:10y:1d", HISTORY_TTL,
+                lambda: stock.history(period="10y", interval="1d"), cache_if=is_cacheable_fetch
+            )
+
+        if not daily.empty:
+            last_date = daily.index[-1]
+            hist_10y_mo = resample_ohlcv(daily[daily.index >= last_date - pd.DateOffset(years=10)], "MS")
+            hist_5y_wk = resample_ohlcv(daily[daily.index >= last_date - pd.DateOffset(years=5)], "W")
+            hist_1y_d = daily[daily.index >= last_date - pd.DateOffset(years=1)]
+        else:
+            hist_10y_mo = hist_5y_wk = hist_1y_d = daily
         
         current_price = hist_1y_d['Close'].iloc[-1] if not hist_1y_d.empty else 0
         
@@ -52,31 +421,26 @@ def get_validated_support_levels(ticker: str):
         
         for tf_name, df in timeframes:
             if len(df) < 200: continue # Need enough data
+
+            low_arr = df['Low'].to_numpy()
+            close_arr = df['Close'].to_numpy()
+            # Local arrays so the (cached) history frame isn't mutated
+            smas = rolling_smas(close_arr, sma_periods)
             
             for period in sma_periods:
-                sma_col = f"SMA_{period}"
-                df[sma_col] = df['Close'].rolling(window=period).mean()
+                sma_arr = smas[period]
+                valid = ~np.isnan(sma_arr)
+                if not valid.any(): continue
+                sma_valid = sma_arr[valid]
                 
-                # Count Bounces
+                # Count Bounces across all valid SMA points
                 # Test: Low < SMA * 1.01 (touched or came close)
                 # Hold: Close > SMA (didn't break)
-                # We iterate through the last N periods (e.g., all available valid SMA points)
-                
-                bounce_count = 0
-                valid_points = df.dropna(subset=[sma_col])
-                
-                for i in range(len(valid_points)):
-                    row = valid_points.iloc[i]
-                    sma_val = row[sma_col]
-                    low = row['Low']
-                    close = row['Close']
-                    
-                    if low <= sma_val * 1.01 and close >= sma_val:
-                        bounce_count += 1
+                bounce_count = int(((low_arr[valid] <= sma_valid * 1.01) & (close_arr[valid] >= sma_valid)).sum())
                 
                 # If significant bounces, add to candidates
                 if bounce_count >= 3:
-                    current_sma = valid_points[sma_col].iloc[-1]
+                    current_sma = sma_valid[-1]
                     if current_sma < current_price: # Must be support
                         support_candidates.append({
                             "price": current_sma,
@@ -88,53 +452,30 @@ def get_validated_support_levels(ticker: str):
         # --- Logic 2: Horizontal Clusters (Swing Lows) ---
         # Use Daily and Weekly data for swing lows
         def get_swing_lows(df, window=5):
-            lows = []
-            for i in range(window, len(df) - window):
-                is_low = True
-                for j in range(1, window + 1):
-                    if df['Low'].iloc[i] > df['Low'].iloc[i-j] or df['Low'].iloc[i] > df['Low'].iloc[i+j]:
-                        is_low = False
-                        break
-                if is_low:
-                    lows.append(df['Low'].iloc[i])
-            return lows
+            # A swing low is no higher than any Low within `window` bars either side of it
+            low = df['Low'].to_numpy()
+            if len(low) < 2 * window + 1:
+                return []
+            windows = np.lib.stride_tricks.sliding_window_view(low, 2 * window + 1)
+            centers = low[window:len(low) - window]
+            return centers[centers <= windows.min(axis=1)].tolist()
 
         swing_lows = []
         swing_lows.extend(get_swing_lows(hist_5y_wk, window=5)) # Weekly lows
         swing_lows.extend(get_swing_lows(hist_1y_d, window=3))  # Daily lows (tighter window)
         
-        swing_lows.sort()
-        
         # Cluster lows within 2%
+        # A sorted low joins the current cluster when it is within 2% of the previous
+        # low (neighbour gap), so a long run of close lows can span more than 2% overall
         clusters = []
         if swing_lows:
-            current_cluster = [swing_lows[0]]
-            
-            for i in range(1, len(swing_lows)):
-                price = swing_lows[i]
-                avg_cluster = sum(current_cluster) / len(current_cluster)
-                
-                if abs(price - avg_cluster) / avg_cluster <= 0.02:
-                    current_cluster.append(price)
-                else:
-                    # Finalize previous cluster
-                    if len(current_cluster) >= 2: # Need at least 2 touches
-                        avg_price = sum(current_cluster) / len(current_cluster)
-                        if avg_price < current_price:
-                            clusters.append({
-                                "price": avg_price,
-                                "count": len(current_cluster)
-                            })
-                    current_cluster = [price]
-            
-            # Add last cluster
-            if len(current_cluster) >= 2:
-                avg_price = sum(current_cluster) / len(current_cluster)
-                if avg_price < current_price:
-                    clusters.append({
-                        "price": avg_price,
-                        "count": len(current_cluster)
-                    })
+            lows = np.sort(np.asarray(swing_lows, dtype=float))
+            breaks = np.flatnonzero(np.diff(lows) / lows[:-1] > 0.02) + 1
+            starts = np.concatenate(([0], breaks))
+            counts = np.diff(np.concatenate((starts, [len(lows)])))
+            means = np.add.reduceat(lows, starts) / counts
+            keep = (counts >= 2) & (means < current_price) # Need at least 2 touches, below price
+            clusters = [{"price": float(m), "count": int(c)} for m, c in zip(means[keep], counts[keep])]
 
         for c in clusters:
             support_candidates.append({
@@ -151,25 +492,20 @@ def get_validated_support_levels(ticker: str):
         # Let's sort by Price Descending (Closeness to current price, assuming support is below)
         
         # Deduplicate (merge close levels)
+        # Walking down in price, a level within 1.5% of the one above it joins that group;
+        # the highest scoring level of each group is kept as the "main" reason
         support_candidates.sort(key=lambda x: x['price'], reverse=True)
         unique_levels = []
         
         if support_candidates:
-            current_level = support_candidates[0]
-            merged_group = [current_level]
-            
-            for i in range(1, len(support_candidates)):
-                next_level = support_candidates[i]
-                if abs(current_level['price'] - next_level['price']) / current_level['price'] <= 0.015:
-                    merged_group.append(next_level)
-                    # Keep the one with highest score as the "main" reason
-                    if next_level['score'] > current_level['score']:
-                        current_level = next_level
-                else:
-                    unique_levels.append(current_level)
-                    current_level = next_level
-                    merged_group = [current_level]
-            unique_levels.append(current_level)
+            prices = np.array([c['price'] for c in support_candidates], dtype=float)
+            scores = np.array([c['score'] for c in support_candidates], dtype=float)
+            cuts = np.flatnonzero(np.abs(np.diff(prices)) / prices[:-1] > 0.015) + 1
+            starts = np.concatenate(([0], cuts))
+            ends = np.concatenate((cuts, [len(prices)]))
+            for group_start, group_end in zip(starts, ends):
+                best = group_start + int(np.argmax(scores[group_start:group_end]))
+                unique_levels.append(support_candidates[best])
 
         return unique_levels[:5]
 
@@ -177,6 +513,19 @@ def get_validated_support_levels(ticker: str):
         print(f"Error in get_validated_support_levels: {e}")
         return []
 
+def with_current_price(valuation, current_price):
+    """Fill the price-dependent valuation fields, so a cached intrinsic value can be re-priced"""
+    intrinsic_value = valuation["intrinsicValue"]
+    # Formula: ((Stock Price / Intrinsic Value) - 1) * 100
+    # We return the decimal here, frontend handles * 100
+    diff_percent = ((current_price / intrinsic_value) - 1) if intrinsic_value and intrinsic_value != 0 else 0
+    
+    status = "Fairly Valued"
+    if diff_percent > 0.15: status = "Overvalued"
+    elif diff_percent < -0.15: status = "Undervalued"
+
+    return {**valuation, "currentPrice": current_price, "differencePercent": diff_percent, "status": status}
+
 def calculate_intrinsic_value(ticker, info, financials, balance_sheet, cashflow, revenue_series, net_income_series, op_cash_flow_series, growth_estimates, beta):
     try:
         current_price = info.get("currentPrice", 0)
@@ -184,6 +533,21 @@ def calculate_intrinsic_value(ticker, info, financials, balance_sheet, cashflow,
         if not current_price or not shares_outstanding:
             return {"status": "Error", "intrinsicValue": 0, "differencePercent": 0, "method": "N/A", "assumptions": {}}
 
+        # --- 0. Statement Metrics ---
+        # One reindex per statement pulls every needed row; missing rows read as 0
+        def latest_column(df, keys):
+            if df.empty:
+                return np.zeros(len(keys))
+            return df.iloc[:, 0].reindex(keys, fill_value=0).to_numpy()
+
+        total_debt, cash1, cash2, equity = latest_column(balance_sheet, [
+            "Total Debt", "Cash And Cash Equivalents",
+            "Cash Cash Equivalents And Short Term Investments", "Stockholders Equity"
+        ])
+        cash_and_equivalents = cash1 if cash1 else cash2
+        capex1, capex2 = latest_column(cashflow, ["Capital Expenditure", "Capital Expenditures"])
+        capex = abs(capex1 if capex1 else capex2)
+
         # --- 1. Determine Company Type & Method ---
         sector = info.get("sector", "")
         industry = info.get("industry", "")
@@ -193,22 +557,19 @@ def calculate_intrinsic_value(ticker, info, financials, balance_sheet, cashflow,
         
         # Check Consistency (Reuse logic or simple check)
         def is_consistent(series):
-            if len(series) < 3: return False
+            arr = np.asarray(series, dtype=float)
+            if arr.size < 3: return False
             # Check if generally increasing (allow one dip)
-            increases = 0
-            for i in range(len(series)-1):
-                if series.iloc[i] >= series.iloc[i+1] * 0.9: # series is desc, so i is newer. newer >= older
-                    increases += 1
-            return increases >= len(series) - 2
+            # series is desc, so each value is newer than the next. newer >= older
+            increases = int((arr[:-1] >= arr[1:] * 0.9).sum())
+            return increases >= arr.size - 2
 
         rev_consistent = is_consistent(revenue_series)
         ni_consistent = is_consistent(net_income_series)
         ocf_consistent = is_consistent(op_cash_flow_series)
         
         # Speculative Check: High Rev Growth (>15%) but Negative NI or OCF
-        rev_cagr = 0
-        if len(revenue_series) >= 3:
-            rev_cagr = (revenue_series.iloc[0] / revenue_series.iloc[-1])**(1/len(revenue_series)) - 1
+        rev_cagr = cagr(revenue_series) or 0
         
         current_ni = net_income_series.iloc[0] if not net_income_series.empty else 0
         current_ocf = op_cash_flow_series.iloc[0] if not op_cash_flow_series.empty else 0
@@ -240,52 +601,12 @@ def calculate_intrinsic_value(ticker, info, financials, balance_sheet, cashflow,
         # Discount Rate Logic
         def get_discount_rate(beta, country):
             beta = float(beta) if beta else 1.0
-            is_china = "China" in country
-            
-            if is_china:
-                if beta < 0.80: return 0.085
-                if beta >= 1.6: return 0.145 # "More than 1.5" (assuming > 1.5 bucket)
-                
-                # Lookup table for China
-                # 0.9: 9.3%, 1.0: 10%, 1.1: 10.8%, 1.2: 11.5%, 1.3: 12.2%, 1.4: 13%, 1.5: 13.7%
-                # Simple linear interpolation or nearest bucket? 
-                # User gave specific points. Let's use thresholds.
-                if beta < 0.85: return 0.085 # < 0.8
-                if beta < 0.95: return 0.093 # ~0.9
-                if beta < 1.05: return 0.100 # ~1.0
-                if beta < 1.15: return 0.108 # ~1.1
-                if beta < 1.25: return 0.115 # ~1.2
-                if beta < 1.35: return 0.122 # ~1.3
-                if beta < 1.45: return 0.130 # ~1.4
-                return 0.137 # ~1.5
-                
-            else: # US / Default
-                if beta < 0.80: return 0.054
-                if beta >= 1.6: return 0.078 # "More than 7.8" seems like a typo for 7.8%? Or beta > 1.5? 
-                # User said "beta More than 7.8: use 5.4%". Wait, "beta More than 7.8" is likely a typo for "beta > 1.5 -> 7.8%"?
-                # Looking at the pattern: 5.4, 5.7, 6.0, 6.3, 6.6, 6.9, 7.2, 7.5. 
-                # The next step would be 7.8%.
-                # But user wrote "beta More than 7.8: use 5.4%". This is contradictory or a specific edge case?
-                # "beta More than 7.8" is extremely high beta. 
-                # Let's assume user meant "beta > 1.5 use 7.8%" based on the progression (0.3% steps).
-                # AND "More than 7.8" might be a typo for "More than 1.5".
-                # However, user explicitly wrote "beta More than 7.8: use 5.4%".
-                # I will follow the progression for > 1.5 as 7.8% (logic) but if beta is actually > 7.8 (rare), use 5.4%?
-                # Actually, looking at the China one: "beta More than 7.8: use 14.5%".
-                # The China progression: 8.5, 9.3 (+0.8), 10.0 (+0.7), 10.8 (+0.8), 11.5 (+0.7), 12.2 (+0.7), 13.0 (+0.8), 13.7 (+0.7).
-                # Next would be ~14.5%.
-                # So "More than 7.8" is almost certainly a typo for "More than 1.5".
-                # I will assume > 1.5 uses the next logical step.
-                
-                if beta < 0.85: return 0.054 # < 0.8
-                if beta < 0.95: return 0.057 # ~0.9
-                if beta < 1.05: return 0.060 # ~1.0
-                if beta < 1.15: return 0.063 # ~1.1
-                if beta < 1.25: return 0.066 # ~1.2
-                if beta < 1.35: return 0.069 # ~1.3
-                if beta < 1.45: return 0.072 # ~1.4
-                if beta < 1.55: return 0.075 # ~1.5
-                return 0.078 # > 1.5 (Assuming typo in user prompt, following progression)
+            if "China" in country:
+                idx = np.searchsorted(DISCOUNT_BETA_EDGES_CN, beta, side="right")
+                return float(DISCOUNT_RATES_CN[idx])
+            # US / Default
+            idx = np.searchsorted(DISCOUNT_BETA_EDGES_US, beta, side="right")
+            return float(DISCOUNT_RATES_US[idx])
 
         beta_val = beta if beta else 1.0
         discount_rate = get_discount_rate(beta_val, country)
@@ -293,27 +614,25 @@ def calculate_intrinsic_value(ticker, info, financials, balance_sheet, cashflow,
         # Growth Rate (Yr 1-5)
         # Try estimates first
         growth_rate_1_5 = 0.05 # Default 5%
-        if growth_estimates:
-            # Look for "Next 5 Years"
-            for est in growth_estimates:
-                if "Next 5 Years" in str(est.get("period", "")):
-                    try:
-                        val_str = str(est.get("stockTrend", "0")).replace("%", "")
-                        growth_rate_1_5 = float(val_str) / 100
-                        break
-                    except: pass
+        if isinstance(growth_estimates, pd.DataFrame) and not growth_estimates.empty and "stockTrend" in growth_estimates.columns:
+            # Look for "Next 5 Years" (newer yfinance labels it "+5y"); the period is the first column
+            periods = growth_estimates.iloc[:, 0].astype(str)
+            mask = periods.str.contains(r"Next 5 Years|\+5y", na=False)
+            if mask.any():
+                stock_trend = growth_estimates.loc[mask, "stockTrend"].iloc[0]
+                # Older yfinance returns "12.5%" strings, newer returns fractions
+                if isinstance(stock_trend, str):
+                    stock_trend = pd.to_numeric(stock_trend.rstrip("%"), errors="coerce") / 100
+                if pd.notna(stock_trend):
+                    growth_rate_1_5 = float(stock_trend)
         else:
-            # Use historical CAGR (Rev or NI)
-            if not net_income_series.empty and len(net_income_series) > 3:
-                try:
-                    start = abs(net_income_series.iloc[-1])
-                    end = net_income_series.iloc[0]
-                    if start > 0:
-                        growth_rate_1_5 = (end/start)**(1/len(net_income_series)) - 1
-                except: pass
+            # Use historical CAGR (NI, needs more than 3 years)
+            ni_cagr = cagr(net_income_series, min_points=4)
+            if ni_cagr is not None:
+                growth_rate_1_5 = ni_cagr
         
         # Cap Growth Rate 1-5 reasonable limits
-        growth_rate_1_5 = min(max(growth_rate_1_5, -0.10), 0.30) # Cap between -10% and 30%
+        growth_rate_1_5 = float(np.clip(growth_rate_1_5, -0.10, 0.30)) # Cap between -10% and 30%
         
         # Growth Rate (Yr 6-10) - Same but capped at 15%
         growth_rate_6_10 = min(growth_rate_1_5, 0.15)
@@ -321,17 +640,6 @@ def calculate_intrinsic_value(ticker, info, financials, balance_sheet, cashflow,
         # Growth Rate (Yr 11-20) - 4% US, 6% China
         growth_rate_11_20 = 0.06 if "China" in country else 0.04
 
-        # Balance Sheet Items
-        total_debt = 0
-        cash_and_equivalents = 0
-        if not balance_sheet.empty:
-            if "Total Debt" in balance_sheet.index:
-                total_debt = balance_sheet.loc["Total Debt"].iloc[0]
-            if "Cash And Cash Equivalents" in balance_sheet.index:
-                cash_and_equivalents = balance_sheet.loc["Cash And Cash Equivalents"].iloc[0]
-            elif "Cash Cash Equivalents And Short Term Investments" in balance_sheet.index:
-                cash_and_equivalents = balance_sheet.loc["Cash Cash Equivalents And Short Term Investments"].iloc[0]
-
         # --- 3. Calculate ---
         intrinsic_value = 0
         assumptions = {}
@@ -340,7 +648,6 @@ def calculate_intrinsic_value(ticker, info, financials, balance_sheet, cashflow,
             # Inputs: Current BVPS, Historical PB
             book_value = info.get("bookValue")
             if not book_value and not balance_sheet.empty:
-                 equity = balance_sheet.loc["Stockholders Equity"].iloc[0] if "Stockholders Equity" in balance_sheet.index else 0
                  book_value = equity / shares_outstanding
             
             # Calculate Historical PB (Approximate using annual close / annual BV)
@@ -381,12 +688,6 @@ def calculate_intrinsic_value(ticker, info, financials, balance_sheet, cashflow,
             
             if "Free Cash Flow" in method:
                 # FCF = OCF - CapEx
-                capex = 0
-                if "Capital Expenditure" in cashflow.index:
-                    capex = abs(cashflow.loc["Capital Expenditure"].iloc[0])
-                elif "Capital Expenditures" in cashflow.index:
-                    capex = abs(cashflow.loc["Capital Expenditures"].iloc[0])
-                
                 base_value = current_ocf - capex
                 metric_name = "Free Cash Flow"
             elif "Operating Cash Flow" in method:
@@ -396,31 +697,18 @@ def calculate_intrinsic_value(ticker, info, financials, balance_sheet, cashflow,
                 base_value = current_ni
                 metric_name = "Net Income"
             
-            # Projection
-            future_values = []
-            current_val = base_value
-            
-            # Yr 1-5
-            for i in range(5):
-                current_val *= (1 + growth_rate_1_5)
-                future_values.append(current_val)
+            # Projection: Yr 1-5, Yr 6-10, Yr 11-20 growth compounded on the base value
+            growth_factors = np.concatenate((
+                np.full(5, 1 + growth_rate_1_5),
+                np.full(5, 1 + growth_rate_6_10),
+                np.full(10, 1 + growth_rate_11_20)
+            ))
+            future_values = base_value * np.cumprod(growth_factors)
             
-            # Yr 6-10
-            for i in range(5):
-                current_val *= (1 + growth_rate_6_10)
-                future_values.append(current_val)
-                
-            # Yr 11-20
-            for i in range(10):
-                current_val *= (1 + growth_rate_11_20)
-                future_values.append(current_val)
-                
             # Discount
-            present_value_sum = 0
-            for i, val in enumerate(future_values):
-                pv = val / ((1 + discount_rate) ** (i + 1))
-                present_value_sum += pv
-                
+            discount_factors = (1 + discount_rate) ** np.arange(1, 21)
+            present_value_sum = float((future_values / discount_factors).sum())
+
             # Equity Value
             equity_value = present_value_sum + cash_and_equivalents - total_debt
             intrinsic_value = equity_value / shares_outstanding
@@ -437,22 +725,11 @@ def calculate_intrinsic_value(ticker, info, financials, balance_sheet, cashflow,
             }
 
         # Finalize
-        # Formula: ((Stock Price / Intrinsic Value) - 1) * 100
-        # We return the decimal here, frontend handles * 100
-        diff_percent = ((current_price / intrinsic_value) - 1) if intrinsic_value and intrinsic_value != 0 else 0
-        
-        status = "Fairly Valued"
-        if diff_percent > 0.15: status = "Overvalued"
-        elif diff_percent < -0.15: status = "Undervalued"
-        
-        return {
+        return with_current_price({
             "method": method,
             "intrinsicValue": intrinsic_value,
-            "currentPrice": current_price,
-            "differencePercent": diff_percent,
-            "status": status,
             "assumptions": assumptions
-        }
+        }, current_price)
 
     except Exception as e:
         print(f"Error calculating intrinsic value: {e}")
@@ -461,12 +738,44 @@ def calculate_intrinsic_value(ticker, info, financials, balance_sheet, cashflow,
 def get_stock_data(ticker: str):
     try:
         stock = yf.Ticker(ticker)
-        info = stock.info
+        symbol = ticker.upper()
+
+        def fetch_growth_estimates():
+            # Try method first (newer yfinance versions)
+            if hasattr(stock, 'get_growth_estimates'):
+                return stock.get_growth_estimates()
+            elif hasattr(stock, 'growth_estimates'):
+                return stock.growth_estimates
+            return None
+
+        # Start every independent Yahoo request up front; results are collected where used
+        fetches = {
+            "info": submit_fetch(f"info:{symbol}", INFO_TTL, lambda: stock.info),
+            "financials": submit_fetch(f"financials:{symbol}", STATEMENT_TTL, lambda: stock.financials),
+            "balance_sheet": submit_fetch(f"balance_sheet:{symbol}", STATEMENT_TTL, lambda: stock.balance_sheet),
+            "cashflow": submit_fetch(f"cashflow:{symbol}", STATEMENT_TTL, lambda: stock.cashflow),
+            "quarterly_financials": submit_fetch(f"quarterly_financials:{symbol}", STATEMENT_TTL, lambda: stock.quarterly_financials),
+            "quarterly_balance_sheet": submit_fetch(f"quarterly_balance_sheet:{symbol}", STATEMENT_TTL, lambda: stock.quarterly_balance_sheet),
+            "quarterly_cashflow": submit_fetch(f"quarterly_cashflow:{symbol}", STATEMENT_TTL, lambda: stock.quarterly_cashflow),
+            "calendar": submit_fetch(f"calendar:{symbol}", STATEMENT_TTL, lambda: stock.calendar),
+            "news": submit_fetch(f"news:{symbol}", NEWS_TTL, lambda: stock.news),
+            "growth_estimates": submit_fetch(f"growth_estimates:{symbol}", STATEMENT_TTL, fetch_growth_estimates),
+            "history": submit_fetch(f"history:{symbol}:{HISTORY_PERIOD}:1d", HISTORY_TTL, lambda: stock.history(period=HISTORY_PERIOD)),
+            "history_intraday": submit_fetch(f"history:{symbol}:5d:15m", INTRADAY_TTL, lambda: stock.history(period="5d", interval="15m")),
+        }
+
+        info = fetches["info"].result()
         
         # Validate if stock exists
         if not info or (info.get("currentPrice") is None and info.get("regularMarketPrice") is None):
             raise ValueError(f"Stock '{ticker}' not found or no data available.")
 
+        # Scalars used across the analysis, read from info once
+        (current_price, pe_ratio, forward_pe, trailing_eps, forward_eps,
+         shares_outstanding, beta, roa, industry, sector) = (info.get(k) for k in (
+            "currentPrice", "trailingPE", "forwardPE", "trailingEps", "forwardEps",
+            "sharesOutstanding", "beta", "returnOnAssets", "industry", "sector"
+        ))
         
         # Helper to map exchange codes
         def get_exchange_name(exchange_code):
@@ -486,32 +795,32 @@ def get_stock_data(ticker: str):
         overview = {
             "name": info.get("longName"),
             "symbol": info.get("symbol"),
-            "price": info.get("currentPrice"),
+            "price": current_price,
             "change": info.get("regularMarketChange", 0),
             "changePercent": info.get("regularMarketChangePercent", 0),
             "exchange": get_exchange_name(info.get("exchange")),
             "currency": info.get("currency"),
-            "sector": info.get("sector"),
-            "industry": info.get("industry"),
+            "sector": sector,
+            "industry": industry,
             "description": info.get("longBusinessSummary"),
             "marketCap": info.get("marketCap"),
-            "beta": info.get("beta"),
-            "peRatio": info.get("trailingPE"),
+            "beta": beta,
+            "peRatio": pe_ratio,
             "pegRatio": info.get("pegRatio") or info.get("trailingPegRatio"),
-            "eps": info.get("trailingEps"),
+            "eps": trailing_eps,
             "dividendYield": info.get("dividendYield"),
         }
 
         # Financials for Growth & Profitability (Annual data)
-        financials = stock.financials
-        balance_sheet = stock.balance_sheet
-        cashflow = stock.cashflow
+        financials = fetches["financials"].result()
+        balance_sheet = fetches["balance_sheet"].result()
+        cashflow = fetches["cashflow"].result()
         
         # Fetch TTM (Trailing Twelve Months) data for ratio calculations
         try:
-            financials_ttm = stock.quarterly_financials
-            balance_sheet_ttm = stock.quarterly_balance_sheet
-            cashflow_ttm = stock.quarterly_cashflow
+            financials_ttm = fetches["quarterly_financials"].result()
+            balance_sheet_ttm = fetches["quarterly_balance_sheet"].result()
+            cashflow_ttm = fetches["quarterly_cashflow"].result()
             
             # Sum last 4 quarters for TTM income statement and cash flow
             if not financials_ttm.empty and len(financials_ttm.columns) >= 4:
@@ -536,19 +845,15 @@ def get_stock_data(ticker: str):
             ttm_cashflow = pd.Series()
             ttm_balance = pd.Series()
         
-        calendar = stock.calendar
-        news_data = stock.news
+        calendar = fetches["calendar"].result()
+        news_data = fetches["news"].result()
         
         # Try to get growth estimates, might vary by yfinance version
         # Try to get growth estimates
         growth_estimates_data = []
+        growth_estimates_df = None
         try:
-            # Try method first (newer yfinance versions)
-            ge = None
-            if hasattr(stock, 'get_growth_estimates'):
-                ge = stock.get_growth_estimates()
-            elif hasattr(stock, 'growth_estimates'):
-                ge = stock.growth_estimates
+            ge = fetches["growth_estimates"].result()
             
             if ge is not None and not ge.empty:
                 # Reset index to make 'Growth Estimates' a column if it's the index
@@ -561,6 +866,7 @@ def get_stock_data(ticker: str):
                 elif 'Growth Estimates' in ge.columns:
                     ge = ge.rename(columns={'Growth Estimates': 'Period'})
                 
+                growth_estimates_df = ge
                 growth_estimates_data = ge.to_dict(orient='records')
 
             growth_estimates = growth_estimates_data
@@ -568,84 +874,69 @@ def get_stock_data(ticker: str):
             print(f"Error fetching growth estimates: {e}")
             growth_estimates = []
 
-        print("\n--- YFINANCE DATA DEBUG ---")
-        print("INFO KEYS:", info.keys())
-        print("\nFINANCIALS (5Y Check):\n", financials.head(5))
-        print("\nBALANCE SHEET (5Y Check):\n", balance_sheet.head(5))
-        print("\nCASHFLOW (5Y Check):\n", cashflow.head(5))
-        print("\nCASHFLOW INDEX:", cashflow.index) # Added to debug OCF
-        print("\nCALENDAR:\n", calendar)
-        print("\nGROWTH ESTIMATES:\n", growth_estimates)
-        print("---------------------------\n")
-
-        # Helper to get value safely
-        def get_val(df, key):
-            try:
-                return df.loc[key].iloc[0] if key in df.index else 0
-            except:
-                return 0
+        # DataFrame reprs are expensive, only build them when debug logging is on
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("--- YFINANCE DATA DEBUG (%s) ---", symbol)
+            logger.debug("INFO KEYS: %s", list(info.keys()))
+            logger.debug("FINANCIALS (5Y Check):\n%s", financials.head(5))
+            logger.debug("BALANCE SHEET (5Y Check):\n%s", balance_sheet.head(5))
+            logger.debug("CASHFLOW (5Y Check):\n%s", cashflow.head(5))
+            logger.debug("CASHFLOW INDEX: %s", cashflow.index) # Added to debug OCF
+            logger.debug("CALENDAR:\n%s", calendar)
+            logger.debug("GROWTH ESTIMATES:\n%s", growth_estimates)
+
+        # Flatten the latest statement columns and TTM series once so scalar lookups are dict gets
+        financials_d = financials.iloc[:, 0].to_dict() if not financials.empty else {}
+        balance_sheet_d = balance_sheet.iloc[:, 0].to_dict() if not balance_sheet.empty else {}
+        ttm_income_d = ttm_income.to_dict()
+        ttm_balance_d = ttm_balance.to_dict()
+        ttm_cashflow_d = ttm_cashflow.to_dict()
         
-        def get_val_by_index(df, key, index):
-            """Get value from dataframe by row key and column index"""
-            try:
-                if key in df.index and index < len(df.columns):
-                    return df.loc[key].iloc[index]
-                return 0
-            except:
-                return 0
-        
-        def get_ttm_val(series, key):
-            """Get value from TTM series"""
-            try:
-                return series.loc[key] if key in series.index else 0
-            except:
-                return 0
-
         # --- Calculate Financial Ratios using TTM Data ---
         
         # ROE = Net Income / Shareholders' Equity (corrected formula)
-        ttm_net_income = get_ttm_val(ttm_income, "Net Income")
-        ttm_equity = get_ttm_val(ttm_balance, "Stockholders Equity")
+        ttm_net_income = ttm_income_d.get("Net Income", 0)
+        ttm_equity = ttm_balance_d.get("Stockholders Equity", 0)
         roe_ttm = (ttm_net_income / ttm_equity) if ttm_equity != 0 else (info.get("returnOnEquity") or 0)
         
         # ROIC = (EBIT * (1 - Tax Rate)) / Invested Capital
-        ttm_ebit = get_ttm_val(ttm_income, "EBIT")
-        ttm_pretax_income = get_ttm_val(ttm_income, "Pretax Income")
-        ttm_tax_provision = get_ttm_val(ttm_income, "Tax Provision")
+        ttm_ebit = ttm_income_d.get("EBIT", 0)
+        ttm_pretax_income = ttm_income_d.get("Pretax Income", 0)
+        ttm_tax_provision = ttm_income_d.get("Tax Provision", 0)
         tax_rate = (ttm_tax_provision / ttm_pretax_income) if ttm_pretax_income != 0 else 0.21  # Default 21%
         
-        ttm_total_debt = get_ttm_val(ttm_balance, "Total Debt")
+        ttm_total_debt = ttm_balance_d.get("Total Debt", 0)
         invested_capital = ttm_equity + ttm_total_debt
         roic_ttm = ((ttm_ebit * (1 - tax_rate)) / invested_capital) if invested_capital != 0 else 0
         
         # Debt-to-EBITDA = Total Debt / EBITDA
-        ttm_ebitda = get_ttm_val(ttm_income, "EBITDA")
+        ttm_ebitda = ttm_income_d.get("EBITDA", 0)
         debt_to_ebitda_ttm = (ttm_total_debt / ttm_ebitda) if ttm_ebitda != 0 else (info.get("debtToEbitda") or 0)
         
         # Debt Servicing Ratio = Interest Expense / Operating Cash Flow
-        ttm_interest_expense = abs(get_ttm_val(ttm_income, "Interest Expense"))
-        ttm_ocf = get_ttm_val(ttm_cashflow, "Operating Cash Flow")
+        ttm_interest_expense = abs(ttm_income_d.get("Interest Expense", 0))
+        ttm_ocf = ttm_cashflow_d.get("Operating Cash Flow", 0)
         debt_servicing_ratio_ttm = ((ttm_interest_expense / ttm_ocf) * 100) if ttm_ocf != 0 else 0
         
         # Current Ratio = Total Current Assets / Total Current Liabilities
-        ttm_current_assets = get_ttm_val(ttm_balance, "Current Assets")
-        ttm_current_liabilities = get_ttm_val(ttm_balance, "Current Liabilities")
+        ttm_current_assets = ttm_balance_d.get("Current Assets", 0)
+        ttm_current_liabilities = ttm_balance_d.get("Current Liabilities", 0)
         current_ratio_ttm = (ttm_current_assets / ttm_current_liabilities) if ttm_current_liabilities != 0 else 0
         
         # Gearing Ratio = (Total Debt / Total Equity) * 100
         gearing_ratio_ttm = ((ttm_total_debt / ttm_equity) * 100) if ttm_equity != 0 else 0
         
-        print(f"\\n--- TTM RATIO CALCULATIONS ---")
-        print(f"ROE (TTM): {roe_ttm*100:.2f}%")
-        print(f"ROIC (TTM): {roic_ttm*100:.2f}%")
-        print(f"Debt-to-EBITDA (TTM): {debt_to_ebitda_ttm:.2f}")
-        print(f"Debt Servicing Ratio (TTM): {debt_servicing_ratio_ttm:.2f}%")
-        print(f"Current Ratio (TTM): {current_ratio_ttm:.2f}")
-        print(f"Gearing Ratio (TTM): {gearing_ratio_ttm:.2f}%")
-
-        print(f"DEBUG: Growth Estimates Data: {growth_estimates_data}")
-        print(f"DEBUG: Financials Columns: {financials.columns}")
-        print(f"DEBUG: Financials Index: {financials.index}")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("--- TTM RATIO CALCULATIONS ---")
+            logger.debug("ROE (TTM): %.2f%%", roe_ttm * 100)
+            logger.debug("ROIC (TTM): %.2f%%", roic_ttm * 100)
+            logger.debug("Debt-to-EBITDA (TTM): %.2f", debt_to_ebitda_ttm)
+            logger.debug("Debt Servicing Ratio (TTM): %.2f%%", debt_servicing_ratio_ttm)
+            logger.debug("Current Ratio (TTM): %.2f", current_ratio_ttm)
+            logger.debug("Gearing Ratio (TTM): %.2f%%", gearing_ratio_ttm)
+            logger.debug("Growth Estimates Data: %s", growth_estimates_data)
+            logger.debug("Financials Columns: %s", financials.columns)
+            logger.debug("Financials Index: %s", financials.index)
 
         # Growth Logic (Simplified)
         revenue = financials.loc["Total Revenue"] if "Total Revenue" in financials.index else pd.Series()
@@ -659,62 +950,73 @@ def get_stock_data(ticker: str):
             revenue_history = [{"date": str(d.date()), "value": v} for d, v in rev_sorted.items()]
 
         # Profitability Logic
-        net_income = get_val(financials, "Net Income")
-        total_equity = get_val(balance_sheet, "Stockholders Equity")
+        net_income = financials_d.get("Net Income", 0)
+        total_equity = balance_sheet_d.get("Stockholders Equity", 0)
         roe = (net_income / total_equity) if total_equity else 0
         
         # Debt Logic
-        total_debt = get_val(balance_sheet, "Total Debt")
-        ebitda = get_val(financials, "EBITDA")
+        total_debt = balance_sheet_d.get("Total Debt", 0)
+        ebitda = financials_d.get("EBITDA", 0)
         debt_to_ebitda = (total_debt / ebitda) if ebitda else 0
 
         # Historical Data for Charts
-        history = stock.history(period="max")
-        history_data = [{"date": date.strftime("%Y-%m-%d"), "close": close} for date, close in zip(history.index, history["Close"])]
+        history = fetches["history"].result()
+
+        # Support levels and intrinsic value only move with new daily bars / statements,
+        # so both are computed once per ticker per (UTC) day.
+        # Support levels need nothing but the daily history, so they are worked out on the
+        # pool while the rest of the response is assembled.
+        today = time.strftime("%Y-%m-%d", time.gmtime())
+        supports_future = yahoo_executor.submit(
+            cached_fetch, f"supports:{symbol}:{today}", DAILY_TTL,
+            lambda: get_validated_support_levels(ticker, daily=history),
+            cache_if=bool # [] means the calculation failed
+        )
 
         # Helper to get series safely
-        def get_series(df, key):
-            if key in df.index:
-                return df.loc[key]
-            return pd.Series()
+        # Each statement is converted to numpy once; rows are then found through a plain
+        # dict instead of an Index membership test plus .loc per key
+        def statement_rows(df):
+            values = df.to_numpy()
+            positions = {}
+            for i, key in enumerate(df.index):
+                positions.setdefault(key, i)
+
+            def get_series(key):
+                i = positions.get(key)
+                if i is None:
+                    return pd.Series()
+                return pd.Series(values[i], index=df.columns, name=key)
+            return get_series
+
+        financials_row = statement_rows(financials)
+        cashflow_row = statement_rows(cashflow)
+        balance_sheet_row = statement_rows(balance_sheet)
 
         # Extract Series
-        revenue_series = get_series(financials, "Total Revenue")
-        net_income_series = get_series(financials, "Net Income")
-        op_income_series = get_series(financials, "Operating Income")
-        cost_of_revenue_series = get_series(financials, "Cost Of Revenue")
-        interest_expense_series = get_series(financials, "Interest Expense")
-        tax_provision_series = get_series(financials, "Tax Provision")
-        pretax_income_series = get_series(financials, "Pretax Income")
-        
-        op_cash_flow_series = get_series(cashflow, "Operating Cash Flow")
+        revenue_series = financials_row("Total Revenue")
+        net_income_series = financials_row("Net Income")
+        op_income_series = financials_row("Operating Income")
+        cost_of_revenue_series = financials_row("Cost Of Revenue")
+        interest_expense_series = financials_row("Interest Expense")
+        tax_provision_series = financials_row("Tax Provision")
+        pretax_income_series = financials_row("Pretax Income")
+        
+        op_cash_flow_series = cashflow_row("Operating Cash Flow")
         if op_cash_flow_series.empty:
-             op_cash_flow_series = get_series(cashflow, "Total Cash From Operating Activities")
+             op_cash_flow_series = cashflow_row("Total Cash From Operating Activities")
 
-        accounts_receivable_series = get_series(balance_sheet, "Accounts Receivable")
+        accounts_receivable_series = balance_sheet_row("Accounts Receivable")
         if accounts_receivable_series.empty:
-            accounts_receivable_series = get_series(balance_sheet, "Net Receivables") # Older yfinance mapping
+            accounts_receivable_series = balance_sheet_row("Net Receivables") # Older yfinance mapping
 
         # --- Growth Calculations ---
         net_income_growth = net_income_series.pct_change(-1).iloc[0] if len(net_income_series) > 1 else 0
         
         eps_growth = 0
-        if "trailingEps" in info and "forwardEps" in info and info["trailingEps"]:
-             try:
-                 eps_growth = ((info["forwardEps"] - info["trailingEps"]) / abs(info["trailingEps"]))
-             except:
-                 pass
-
-        # Process Growth Estimates for Table
-        growth_estimates_data = []
-        if isinstance(growth_estimates, pd.DataFrame) and not growth_estimates.empty:
-             for index, row in growth_estimates.iterrows():
-                 growth_estimates_data.append({
-                     "period": str(index),
-                     "stockTrend": row.get("stockTrend"),
-                     "indexTrend": row.get("indexTrend"),
-                     "industryTrend": row.get("industryTrend")
-                 })
+        # Checked up front rather than catching the TypeError/ZeroDivisionError
+        if isinstance(trailing_eps, (int, float)) and isinstance(forward_eps, (int, float)) and trailing_eps:
+            eps_growth = (forward_eps - trailing_eps) / abs(trailing_eps)
 
         # --- Calculations for Tables ---
         
@@ -731,26 +1033,25 @@ def get_stock_data(ticker: str):
         # Helper to format series for table (Values + Growth Rate)
         def format_series_table(series, name):
             if series.empty:
-                print(f"DEBUG: Series {name} is empty")
+                logger.debug("Series %s is empty", name)
                 return []
             
-            # Limit to 5 years
-            series_5y = series.iloc[:5]
-            
             # Calculate Growth (YoY) - Note: yfinance data is usually descending (newest first)
             # So pct_change(-1) compares current year to previous year (next index)
-            growth_series = series.pct_change(-1) * 100
+            # Only the 5 shown years (plus the one before them) are needed
+            growth = series.iloc[:6].pct_change(-1).mul(100).to_numpy(dtype=float)[:5]
             
-            table_data = []
-            for date, value in series_5y.items():
-                growth = growth_series.loc[date] if date in growth_series.index else 0
-                val = float(value) if not pd.isna(value) else 0
-                table_data.append({
-                    "date": date.strftime("%Y-%m-%d"),
-                    "value": val,
-                    "growth": float(growth) if not pd.isna(growth) else 0
-                })
-            print(f"DEBUG: Formatted {name}: {len(table_data)} rows")
+            # Limit to 5 years; NaN values and growth read as 0
+            vals = series.to_numpy(dtype=float)[:5]
+            vals = np.where(np.isnan(vals), 0.0, vals)
+            growth = np.where(np.isnan(growth), 0.0, growth)
+            dates = series.index[:5].strftime("%Y-%m-%d").tolist()
+            
+            table_data = [
+                {"date": date, "value": val, "growth": g}
+                for date, val, g in zip(dates, vals.tolist(), growth.tolist())
+            ]
+            logger.debug("Formatted %s: %d rows", name, len(table_data))
             return table_data
 
         # --- Advanced Metrics Calculations (Latest) ---
@@ -772,10 +1073,8 @@ def get_stock_data(ticker: str):
         # Gearing Ratio: Now using TTM calculated value (for all stocks, not just REITs)
         gearing_ratio = gearing_ratio_ttm
         is_reit = False
-        industry = info.get("industry", "")
-        sector = info.get("sector", "")
         
-        if "REIT" in industry or "Real Estate" in sector:
+        if "REIT" in (industry or "") or "Real Estate" in (sector or ""):
             is_reit = True
 
         # Helper to format DataFrame for frontend
@@ -784,12 +1083,11 @@ def get_stock_data(ticker: str):
                 return []
             df_5y = df.iloc[:, :5]
             dates = [d.strftime("%Y-%m-%d") for d in df_5y.columns]
-            metrics = []
-            for index, row in df_5y.iterrows():
-                metrics.append({
-                    "name": str(index),
-                    "values": row.tolist()
-                })
+            # One to_numpy pass instead of a Series per row
+            metrics = [
+                {"name": str(index), "values": values}
+                for index, values in zip(df_5y.index, df_5y.to_numpy().tolist())
+            ]
             return {"dates": dates, "metrics": metrics}
 
         # Format Financials
@@ -803,51 +1101,39 @@ def get_stock_data(ticker: str):
 
 
         # --- New Data Fetching ---
-        shares_outstanding = info.get("sharesOutstanding")
-        news = stock.news
+        news = fetches["news"].result()
         
         # CEO
-        company_officers = info.get("companyOfficers", [])
-        ceo = "N/A"
-        for officer in company_officers:
-            if "CEO" in officer.get("title", "").upper():
-                ceo = officer.get("name")
-                break
+        company_officers = info.get("companyOfficers") or []
+        ceo = next((o.get("name") for o in company_officers if "CEO" in (o.get("title") or "").upper()), "N/A")
         
         # Intraday History (for 1D/5D charts)
         # Note: 1d interval might not be enough for 1D chart, but yfinance 1m/5m has limits.
         # We'll fetch 5d with 15m interval to cover 1D and 5D reasonably well.
+        intraday_data = []
         try:
-            history_intraday = stock.history(period="5d", interval="15m")
-            intraday_data = [{"date": date.strftime("%Y-%m-%d %H:%M"), "close": close} for date, close in zip(history_intraday.index, history_intraday["Close"])]
-        except:
-            intraday_data = []
+            history_intraday = fetches["history_intraday"].result()
+            if not history_intraday.empty:
+                intraday_data = close_records(history_intraday, with_time=True)
+        except Exception as e:
+            print(f"Error fetching intraday history: {e}")
 
         # Calculate SMAs for Daily History
-        # history is already fetched as 5y daily
-        for period in [50, 100, 150, 200]:
-            history[f"SMA_{period}"] = history["Close"].rolling(window=period).mean()
-        
-        # Update history_data to include SMAs
-        history_data = []
-        for date, row in history.iterrows():
-            item = {
-                "date": date.strftime("%Y-%m-%d"),
-                "close": row["Close"]
-            }
-            # Add SMAs if they exist (not NaN)
-            for period in [50, 100, 150, 200]:
-                val = row[f"SMA_{period}"]
-                if not pd.isna(val):
-                    item[f"SMA_{period}"] = val
-            history_data.append(item)
+        # Built column-wise from numpy arrays; the cached history frame is left untouched
+        sma_periods = (50, 100, 150, 200)
+        close_arr = history["Close"].to_numpy(dtype=float)
+        smas = rolling_smas(close_arr, sma_periods)
+        sma_keys = [f"SMA_{period}" for period in sma_periods]
+        dates = format_dates(history.index)
+        
+        # Add SMAs only where they exist (not NaN)
+        history_data = [
+            {"date": date, "close": close, **{key: v for key, v in zip(sma_keys, row_smas) if not math.isnan(v)}}
+            for date, close, *row_smas in zip(dates, close_arr.tolist(), *(smas[p].tolist() for p in sma_periods))
+        ]
 
         # --- Valuation Calculation (needed for scoring) ---
         # Simple valuation status based on P/E ratio comparison
-        current_price = info.get("currentPrice", 0)
-        pe_ratio = info.get("trailingPE")
-        forward_pe = info.get("forwardPE")
-        
         # Quick valuation assessment
         valuation_status = "Unknown"
         if pe_ratio and forward_pe:
@@ -875,71 +1161,8 @@ def get_stock_data(ticker: str):
             
             if series.empty or len(series) < 2: return False
             
-            # Ensure Descending Order (Newest First)
-            series = series.sort_index(ascending=False)
-            
-            # Series is descending by date (Newest at index 0)
-            newest = series.iloc[0]
-            oldest = series.iloc[-1]
-            
-            if trend_type == "increasing":
-                # 1. Overall Increase (Newest > Oldest)
-                if newest > oldest: return True
-                
-                # 2. Linear Regression Slope (Check if generally trending up)
-                try:
-                    y = series.values
-                    x = np.arange(len(y)) # 0, 1, 2... (Newest to Oldest)
-                    # We want slope of Oldest -> Newest. 
-                    # So reverse y to be Oldest -> Newest
-                    y_rev = y[::-1]
-                    x_rev = np.arange(len(y))
-                    slope, _ = np.polyfit(x_rev, y_rev, 1)
-                    if slope > 0: return True
-                except:
-                    pass
-
-                # 3. Consistent Increase (Year over Year)
-                chronological = series.iloc[::-1]
-                consistent = True
-                for i in range(1, len(chronological)):
-                    prev = chronological.iloc[i-1]
-                    curr = chronological.iloc[i]
-                    # Allow tolerance fluctuation
-                    if curr < prev * (1 - tolerance):
-                        consistent = False
-                        break
-                return consistent
-
-            elif trend_type == "stable_increasing":
-                # Pass if Newest >= Oldest * (1 - tolerance)
-                if newest >= oldest * (1 - tolerance): return True
-                
-                # Check Slope for "Stable/Increasing"
-                try:
-                    y_rev = series.values[::-1]
-                    x_rev = np.arange(len(series))
-                    slope, _ = np.polyfit(x_rev, y_rev, 1)
-                    if slope >= 0: return True # Positive or flat slope
-                except:
-                    pass
-                return False
-
-            elif trend_type == "reducing_stable":
-                # Pass if Newest <= Oldest * (1 + tolerance)
-                if newest <= oldest * (1 + tolerance): return True
-                
-                # Check Slope (should be negative or zero)
-                try:
-                    y_rev = series.values[::-1]
-                    x_rev = np.arange(len(series))
-                    slope, _ = np.polyfit(x_rev, y_rev, 1)
-                    if slope <= 0: return True
-                except:
-                    pass
-                return False
-                
-            return False
+            # Sort once, Oldest -> Newest, as plain floats
+            return trend_passes([float(v) for v in series.sort_index().tolist()], trend_type, tolerance)
 
         # 0. Historical Trend (20 Years) - Moved to Top
         trend_pass = False
@@ -954,36 +1177,39 @@ def get_stock_data(ticker: str):
                 if history.index.tz is not None:
                     cutoff_date = cutoff_date.tz_localize(history.index.tz)
                 
-                hist_20y = history[history.index >= cutoff_date]
+                # Binary search for the cutoff instead of a boolean mask over every row
+                start = history.index.searchsorted(cutoff_date)
+                close_20y = history["Close"].to_numpy(dtype=float)[start:]
+                dates_20y = history.index.values[start:]
                 
-                if not hist_20y.empty:
-                    start_price = hist_20y["Close"].iloc[0]
-                    end_price = hist_20y["Close"].iloc[-1]
-                    max_price = hist_20y["Close"].max()
+                if close_20y.size:
+                    start_price = close_20y[0]
+                    end_price = close_20y[-1]
+                    max_price = np.nanmax(close_20y)
                     
                     # Calculate CAGR
                     # Ensure we have at least some duration to avoid division by zero
-                    days = (hist_20y.index[-1] - hist_20y.index[0]).days
+                    days = (dates_20y[-1] - dates_20y[0]) // np.timedelta64(1, "D")
                     years = days / 365.25
                     
                     if years > 1 and start_price > 0:
-                        cagr = (end_price / start_price) ** (1 / years) - 1
+                        price_cagr = (end_price / start_price) ** (1 / years) - 1
                     else:
                         # Fallback for very short history or zero start price
-                        cagr = 0
+                        price_cagr = 0
                         
                     # Calculate Drawdown from All-Time High (in this period)
                     drawdown = (max_price - end_price) / max_price if max_price > 0 else 0
                     
                     # Logic Implementation
-                    if cagr < 0:
+                    if price_cagr < 0:
                         # Scenario C: Downtrend
                         trend_pass = False
-                        trend_val = f"Downtrend (CAGR {cagr:.1%})"
-                    elif cagr < 0.05:
+                        trend_val = f"Downtrend (CAGR {price_cagr:.1%})"
+                    elif price_cagr < 0.05:
                         # Scenario B: Stagnant / Low Growth
                         trend_pass = False
-                        trend_val = f"Stagnant (CAGR {cagr:.1%})"
+                        trend_val = f"Stagnant (CAGR {price_cagr:.1%})"
                     elif drawdown > 0.30:
                         # Scenario A: Significant Decline from Peak
                         trend_pass = False
@@ -991,7 +1217,7 @@ def get_stock_data(ticker: str):
                     else:
                         # Pass: Strong Growth + Momentum
                         trend_pass = True
-                        trend_val = f"Increasing (CAGR {cagr:.1%})"
+                        trend_val = f"Increasing (CAGR {price_cagr:.1%})"
                         
         except Exception as e:
             print(f"Error calculating historical trend: {e}")
@@ -1061,32 +1287,39 @@ def get_stock_data(ticker: str):
         
         try:
             # Check if company has inventory
-            recent_inventory = get_ttm_val(ttm_balance, "Inventory")
+            recent_inventory = ttm_balance_d.get("Inventory", 0)
             if recent_inventory > 0:
                 has_physical_goods = True
             else:
                 ccc_not_applicable_reason = "Company does not handle physical inventory"
             
             if has_physical_goods:
-                ccc_values = []
-                ccc_dates = []
-                for i in range(min(5, len(balance_sheet.columns))):
-                    inventory = get_val_by_index(balance_sheet, "Inventory", i)
-                    ar = get_val_by_index(balance_sheet, "Accounts Receivable", i)
-                    ap = get_val_by_index(balance_sheet, "Accounts Payable", i)
-                    cogs = get_val_by_index(financials, "Cost Of Revenue", i)
-                    revenue_val = get_val_by_index(financials, "Total Revenue", i)
-                    
-                    if cogs > 0 and revenue_val > 0:
-                        days_inventory = (inventory / cogs) * 365 if inventory and cogs else 0
-                        days_receivable = (ar / revenue_val) * 365 if ar and revenue_val else 0
-                        days_payable = (ap / cogs) * 365 if ap and cogs else 0
-                        ccc = days_inventory + days_receivable - days_payable
-                        ccc_values.append(ccc)
-                        ccc_dates.append(balance_sheet.columns[i])
+                n_periods = min(5, len(balance_sheet.columns))
+
+                def statement_row(df, key):
+                    """First n_periods values of a statement row by column position, 0 where missing"""
+                    row = np.zeros(n_periods)
+                    if key in df.index:
+                        vals = df.loc[key].to_numpy(dtype=float)[:n_periods]
+                        row[:len(vals)] = vals
+                    return row
+
+                inventory = statement_row(balance_sheet, "Inventory")
+                ar = statement_row(balance_sheet, "Accounts Receivable")
+                ap = statement_row(balance_sheet, "Accounts Payable")
+                cogs = statement_row(financials, "Cost Of Revenue")
+                revenue_val = statement_row(financials, "Total Revenue")
                 
-                if ccc_values:
-                    ccc_series = pd.Series(ccc_values, index=ccc_dates)
+                # Periods without positive COGS and revenue are skipped
+                valid = (cogs > 0) & (revenue_val > 0)
+                with np.errstate(divide="ignore", invalid="ignore"):
+                    days_inventory = np.where(inventory != 0, inventory / cogs * 365, 0)
+                    days_receivable = np.where(ar != 0, ar / revenue_val * 365, 0)
+                    days_payable = np.where(ap != 0, ap / cogs * 365, 0)
+                ccc = days_inventory + days_receivable - days_payable
+                
+                if valid.any():
+                    ccc_series = pd.Series(ccc[valid], index=balance_sheet.columns[:n_periods][valid])
                     ccc_pass = check_trend(ccc_series, "reducing_stable", tolerance=0.1)
                     score_criteria.append({"name": "CCC Stable/Reducing", "status": "Pass" if ccc_pass else "Fail", "value": f"{ccc_series.iloc[0]:.0f} days"})
         except Exception as e:
@@ -1100,30 +1333,21 @@ def get_stock_data(ticker: str):
         # 4. Network Effect -> Net Margin (>20% High, >10% Low)
         # 5. Switching Cost -> Revenue Growth (>15% High, >5% Low)
         
-        moat_score = 0
-        
-        # Brand (Gross Margin)
-        gm_val = gross_margin_series.iloc[0] if not gross_margin_series.empty else 0
-        if gm_val > 40: moat_score += 1
-        elif gm_val > 20: moat_score += 0.5
-        
-        # Barriers (ROIC)
-        if roic > 0.15: moat_score += 1
-        elif roic > 0.10: moat_score += 0.5
-        
-        # Scale (Revenue)
-        rev_val = revenue_series.iloc[0] if not revenue_series.empty else 0
-        if rev_val > 100e9: moat_score += 1
-        elif rev_val > 10e9: moat_score += 0.5
-        
-        # Network (Net Margin)
-        nm_val = net_margin_series.iloc[0] if not net_margin_series.empty else 0
-        if nm_val > 20: moat_score += 1
-        elif nm_val > 10: moat_score += 0.5
-        
-        # Switching (Revenue Growth)
-        if revenue_growth > 0.15: moat_score += 1
-        elif revenue_growth > 0.05: moat_score += 0.5
+        def bucket(x, hi, lo):
+            return 1 if x > hi else 0.5 if x > lo else 0
+
+        def latest(series):
+            return float(series.iloc[0]) if len(series) else 0.0
+
+        # (value, high threshold, low threshold) per factor
+        moat_factors = [
+            (latest(gross_margin_series), 40, 20),   # Brand (Gross Margin)
+            (roic, 0.15, 0.10),                      # Barriers (ROIC)
+            (latest(revenue_series), 100e9, 10e9),   # Scale (Revenue)
+            (latest(net_margin_series), 20, 10),     # Network (Net Margin)
+            (revenue_growth, 0.15, 0.05),            # Switching (Revenue Growth)
+        ]
+        moat_score = sum(bucket(*factor) for factor in moat_factors)
         
         moat_type = "None"
         if moat_score > 3: moat_type = "Wide"
@@ -1220,28 +1444,11 @@ def get_stock_data(ticker: str):
         else:
             current_weights = weights_standard
 
-        total_score = 0
-        max_score = 0 # Should sum to 100 ideally, but we calculate dynamically to be safe
-
-        for criterion in score_criteria:
-            name = criterion["name"]
-            # Handle partial matches for combined criteria names if necessary, 
-            # but here we map exact names or simplified keys.
-            
-            # Normalize name for lookup (remove specific values like "(20Y) increasing")
-            lookup_name = name
-            if "Historical Trend" in name: lookup_name = "Historical Trend (20Y)"
-            if "Net Income Increasing" in name: lookup_name = "Net Income Increasing"
-            if "Operating Income Increasing" in name: lookup_name = "Operating Income Increasing"
-            
-            weight = current_weights.get(lookup_name, 0)
-            
-            # Add to max score
-            max_score += weight
-            
-            # Add to total score if passed
-            if criterion["status"] == "Pass":
-                total_score += weight
+        # Criterion names are appended with the exact weight keys, so they are looked up directly
+        weights = [current_weights.get(c["name"], 0) for c in score_criteria]
+        # max_score should sum to 100 ideally, but we calculate dynamically to be safe
+        max_score = sum(weights)
+        total_score = sum(w for w, c in zip(weights, score_criteria) if c["status"] == "Pass")
 
         # Normalize to 100 if max_score is not 100 (just in case)
         # But based on user request, these are percentages, so max_score should be ~100.
@@ -1254,11 +1461,27 @@ def get_stock_data(ticker: str):
         # --- Support Resistance Calculation ---
         support_resistance_data = {}
         try:
-            levels = get_validated_support_levels(ticker)
+            levels = supports_future.result()
             support_resistance_data = {"levels": levels}
         except Exception as e:
             print(f"Error calculating support levels: {e}")
 
+        # --- Valuation ---
+        valuation = cached_fetch(
+            f"valuation:{symbol}:{today}", DAILY_TTL,
+            lambda: calculate_intrinsic_value(
+                ticker, info, financials, balance_sheet, cashflow, 
+                revenue_series, net_income_series, op_cash_flow_series, 
+                growth_estimates_df, beta=beta
+            ),
+            # Only successful valuations are priced. PB values book value at the live
+            # priceToBook, so they move with the price and can't be kept for the day.
+            cache_if=lambda v: "currentPrice" in v and v["method"] != "Mean Price-to-Book (PB)"
+        )
+        if "currentPrice" in valuation:
+            # Re-price a cached valuation against the live quote
+            valuation = with_current_price(valuation, current_price or 0)
+
         return {
             "overview": {**overview, "ceo": ceo},
             "growth": {
@@ -1278,7 +1501,7 @@ def get_stock_data(ticker: str):
                 "grossMargin": gross_margin_series.iloc[0] if not gross_margin_series.empty else 0,
                 "netMargin": net_margin_series.iloc[0] if not net_margin_series.empty else 0,
                 "roe": roe_ttm,  # Use TTM calculated value
-                "roa": info.get("returnOnAssets"),
+                "roa": roa,
                 "roic": roic,
                 "ccc_history": format_series_table(ccc_series, "Cash Conversion Cycle (Days)"),
                 "ccc_not_applicable_reason": ccc_not_applicable_reason,
@@ -1300,11 +1523,7 @@ def get_stock_data(ticker: str):
                 "type": moat_type,
                 "details": "High ROE and Margins indicate potential moat"
             },
-            "valuation": calculate_intrinsic_value(
-                ticker, info, financials, balance_sheet, cashflow, 
-                revenue_series, net_income_series, op_cash_flow_series, 
-                growth_estimates_data, beta=info.get("beta")
-            ),
+            "valuation": valuation,
             "financials": {
                 "income_statement": financials_data,
                 "balance_sheet": balance_sheet_data,
@@ -1330,25 +1549,161 @@ def get_stock_data(ticker: str):
 async def get_stock_history(ticker: str, period: str = "20y"):
     try:
         stock = yf.Ticker(ticker)
-        history = stock.history(period=period)
+        history = await asyncio.to_thread(
+            cached_fetch, f"history:{ticker.upper()}:{period}:1d", HISTORY_TTL, lambda: stock.history(period=period), is_cacheable_fetch
+        )
         if history.empty:
-            return []
+            return ORJSONResponse([])
         
-        history_data = [{"date": date.strftime("%Y-%m-%d"), "close": close} for date, close in zip(history.index, history["Close"])]
-        return history_data
+        history_data = close_records(history)
+        # Response object, so FastAPI skips its jsonable_encoder pass over every row
+        return ORJSONResponse(history_data)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-import math
+# Map timeframe to yfinance period and interval
+# We fetch extra data for SMA calculation, then trim to the most recent display_points
+# NOTE: yfinance has limits on intraday data - 30m interval max is 60 days
+TIMEFRAME_CONFIG = {
+    "1D": {"fetch_period": "5d", "interval": "1m", "display_points": 390},  # ~390 minutes in a trading day (6.5 hours)
+    "5D": {"fetch_period": "1mo", "interval": "5m", "display_points": 390},  # ~390 5-min intervals over 5 days
+    "1M": {"fetch_period": "60d", "interval": "30m", "display_points": 260},  # yfinance 30m limit is 60 days; ~260 30-min intervals in a month
+    "3M": {"fetch_period": "6mo", "interval": "1h", "display_points": 585},  # ~585 1-hour intervals in 3 months (90 days * 6.5 hours)
+    "6M": {"fetch_period": "2y", "interval": "1h", "display_points": 960},  # Fetch 2y, show 6M (~960 hours = 6mo * 30d * 6.5h/day)
+    # Daily and longer bars are cut from the one cached full daily history
+    "YTD": {"fetch_period": "max", "interval": "1d", "display_points": None},  # Filter to YTD
+    "1Y": {"fetch_period": "max", "interval": "1d", "display_points": 252},  # Show 1Y (~252 trading days)
+    "5Y": {"fetch_period": "max", "interval": "1wk", "display_points": 260},  # Show 5Y (~260 weeks)
+    "All": {"fetch_period": "max", "interval": "1mo", "display_points": None}  # Show all
+}
+DEFAULT_TIMEFRAME_CONFIG = {"fetch_period": "1y", "interval": "1d", "display_points": None}
+# Bars of these intervals are labelled with their time of day
+INTRADAY_INTERVALS = frozenset({"1m", "5m", "30m", "1h"})
+
+def chart_cache_key(symbol, config):
+    return f"chart:{symbol}:{config['fetch_period']}:{config['interval']}"
+
+def chart_history(raw, config):
+    """
+    Bars for a timeframe with SMAs calculated on the FULL fetched dataset.
+    For "max" fetches raw is the full daily history, resampled here to weekly/monthly bars.
+    """
+    if raw.empty:
+        # yfinance's empty frame for a failed fetch has no DatetimeIndex to resample
+        return raw
+    history = raw
+    if config["fetch_period"] == "max" and config["interval"] in YAHOO_BAR_RESAMPLE:
+        history = resample_ohlcv(history, **YAHOO_BAR_RESAMPLE[config["interval"]])
+    
+    # One prefix sum serves all four windows, added to the frame in a single assignment.
+    # float32 is plenty for plotted averages and halves the bytes the SMA columns take.
+    smas = rolling_smas(history["Close"].to_numpy(dtype=float), (50, 100, 150, 200), dtype=np.float32)
+    return history.assign(**{f"SMA_{sma_period}": sma for sma_period, sma in smas.items()})
+
+def chart_payload(history, timeframe, config):
+    """Trim a chart history to its display period and lay it out column-wise"""
+    if history.empty:
+        return {"interval": config["interval"], "date": [], "close": []}
+
+    # Trim to display period
+    if config["display_points"]:
+        history = history.tail(config["display_points"])
+    elif timeframe == "YTD":
+        # Filter to year-to-date
+        current_year = pd.Timestamp.now().year
+        history = history[history.index.year == current_year]
+    
+    # Format date/time based on interval
+    dates = format_dates(history.index, with_time=config["interval"] in INTRADAY_INTERVALS)
+    # SMA windows longer than the fetched bars are NaN throughout and are left out
+    sma_keys = [key for key in (f"SMA_{sma_period}" for sma_period in [50, 100, 150, 200]) if history[key].notna().any()]
+    
+    def column(key):
+        # orjson only writes C-contiguous arrays natively; SMAs keep their float32 dtype
+        return np.ascontiguousarray(history[key].to_numpy())
+    
+    # Columnar payload: one array per field rather than a dict per bar, so keys aren't
+    # repeated for every point. orjson writes the arrays natively, NaN as null.
+    return {
+        "interval": config["interval"],
+        "date": dates,
+        "close": column("Close"),
+        **{key: column(key) for key in sma_keys},
+    }
 
-def clean_nan(obj):
-    if isinstance(obj, float):
-        return None if math.isnan(obj) or math.isinf(obj) else obj
-    elif isinstance(obj, dict):
-        return {k: clean_nan(v) for k, v in obj.items()}
-    elif isinstance(obj, list):
-        return [clean_nan(v) for v in obj]
-    return obj
+# Yahoo's multi-symbol download takes up to ~20 symbols per request
+CHART_BATCH_GROUP_SIZE = 20
+
+@app.get("/api/chart/batch")
+async def get_chart_batch(tickers: str, timeframe: str = "1Y"):
+    """
+    Chart data for several comma-separated tickers (?tickers=AAPL,MSFT&timeframe=1Y).
+    Uncached tickers are downloaded together, one Yahoo request per group of 20;
+    a ticker without data reports an error instead of failing the whole batch.
+    """
+    symbols = list(dict.fromkeys(t.strip().upper() for t in tickers.split(",") if t.strip()))
+    if not symbols:
+        raise HTTPException(status_code=400, detail="No tickers provided.")
+    config = TIMEFRAME_CONFIG.get(timeframe, DEFAULT_TIMEFRAME_CONFIG)
+    ttl = CHART_TTL.get(config["interval"], HISTORY_TTL)
+    full_history = config["fetch_period"] == "max"
+    intraday = config["interval"] in INTRADAY_INTERVALS
+
+    def load_group(group):
+        histories = {}
+        missing = []
+        for symbol in group:
+            hit, history = cache_get(chart_cache_key(symbol, config))
+            if hit:
+                histories[symbol] = history
+            else:
+                missing.append(symbol)
+        if not missing:
+            return histories
+
+        with yahoo_semaphore:
+            data = yf.download(
+                missing,
+                period="max" if full_history else config["fetch_period"],
+                interval="1d" if full_history else config["interval"],
+                group_by="ticker", threads=True, progress=False
+            )
+        if data is None or data.empty:
+            return histories
+        for symbol in missing:
+            if isinstance(data.columns, pd.MultiIndex):
+                if symbol not in data.columns.get_level_values(0):
+                    continue
+                raw = data[symbol]
+            else:
+                raw = data
+            # The download aligns every symbol on one index, drop the dates this one lacks
+            raw = raw.dropna(subset=["Close"])
+            if raw.empty:
+                continue
+            # Only the chart key is cached: this slice is shaped by the multi-ticker download
+            # (tz-naive, no Dividends/Stock Splits) unlike the history:{symbol}:max:1d frames
+            history = chart_history(raw, config)
+            if not intraday:
+                # Intraday bars of a mixed-exchange download share one timezone, so caching
+                # them would shift the single-ticker chart's times to another exchange's zone
+                cache_set(chart_cache_key(symbol, config), history, ttl)
+            histories[symbol] = history
+        return histories
+
+    groups = [symbols[i:i + CHART_BATCH_GROUP_SIZE] for i in range(0, len(symbols), CHART_BATCH_GROUP_SIZE)]
+    try:
+        loaded = await asyncio.gather(*(asyncio.to_thread(load_group, group) for group in groups))
+    except Exception as e:
+        print(f"Error fetching batch chart data ({timeframe}): {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+    histories = {symbol: history for group in loaded for symbol, history in group.items()}
+    results = {
+        symbol: chart_payload(histories[symbol], timeframe, config) if symbol in histories else {"error": "No data found"}
+        for symbol in symbols
+    }
+    return ORJSONResponse(results)
 
 @app.get("/api/chart/{ticker}/{timeframe}")
 async def get_chart(ticker: str, timeframe: str):
@@ -1358,72 +1713,28 @@ async def get_chart(ticker: str, timeframe: str):
     """
     try:
         stock = yf.Ticker(ticker)
+        config = TIMEFRAME_CONFIG.get(timeframe, DEFAULT_TIMEFRAME_CONFIG)
         
-        # Map timeframe to yfinance period and interval
-        # We fetch extra data for SMA calculation, then trim to display
-        # NOTE: yfinance has limits on intraday data - 30m interval max is 60 days
-        timeframe_config = {
-            "1D": {"fetch_period": "5d", "interval": "1m", "display_points": None},  # Show last day
-            "5D": {"fetch_period": "1mo", "interval": "5m", "display_points": None},  # Show last 5 days
-            "1M": {"fetch_period": "60d", "interval": "30m", "display_points": 260},  # yfinance 30m limit is 60 days
-            "3M": {"fetch_period": "6mo", "interval": "1h", "display_points": None},  # Show last 3 months
-            "6M": {"fetch_period": "2y", "interval": "1h", "display_points": 960},  # Fetch 2y, show 6M (~960 hours = 6mo * 30d * 6.5h/day)
-            "YTD": {"fetch_period": "2y", "interval": "1d", "display_points": None},  # Fetch 2y, filter to YTD
-            "1Y": {"fetch_period": "3y", "interval": "1d", "display_points": 252},  # Fetch 3y, show 1Y (~252 trading days)
-            "5Y": {"fetch_period": "10y", "interval": "1wk", "display_points": 260},  # Fetch 10y, show 5Y (~260 weeks)
-            "All": {"fetch_period": "max", "interval": "1mo", "display_points": None}  # Show all
-        }
-        
-        config = timeframe_config.get(timeframe, {"fetch_period": "1y", "interval": "1d", "display_points": None})
-        
-        # Fetch historical data (more than we'll display)
-        history = stock.history(period=config["fetch_period"], interval=config["interval"])
-        
-        # Calculate SMAs on the FULL dataset
-        for sma_period in [50, 100, 150, 200]:
-            history[f"SMA_{sma_period}"] = history["Close"].rolling(window=sma_period).mean()
-        
-        # Trim to display period
-        if config["display_points"]:
-            history = history.tail(config["display_points"])
-        elif timeframe == "YTD":
-            # Filter to year-to-date
-            current_year = pd.Timestamp.now().year
-            history = history[history.index.year == current_year]
-        elif timeframe in ["1D", "5D", "1M", "3M"]:
-            # For these timeframes, show the most recent data
-            # Calculate based on timeframe
-            points_to_show = {
-                "1D": 390,      # ~390 minutes in a trading day (6.5 hours)
-                "5D": 390,      # ~390 5-min intervals over 5 days
-                "1M": 260,      # ~260 30-min intervals in a month (30 days * 6.5 hours * 2)
-                "3M": 585       # ~585 1-hour intervals in 3 months (90 days * 6.5 hours)
-            }
-            if timeframe in points_to_show:
-                history = history.tail(points_to_show[timeframe])
-        
-        # Format data
-        chart_data = []
-        for date, row in history.iterrows():
-            # Format date/time based on interval
-            if config["interval"] in ["1m", "5m", "30m", "1h"]:
-                date_str = date.strftime("%Y-%m-%d %H:%M")
+        def load_history():
+            # Fetch historical data (more than we'll display)
+            if config["fetch_period"] == "max":
+                raw = get_full_history(ticker)
             else:
-                date_str = date.strftime("%Y-%m-%d")
-            
-            item = {
-                "date": date_str,
-                "close": row["Close"]
-            }
-            
-            # Add SMAs if they exist
-            for sma_period in [50, 100, 150, 200]:
-                if f"SMA_{sma_period}" in row and not pd.isna(row[f"SMA_{sma_period}"]):
-                    item[f"SMA_{sma_period}"] = row[f"SMA_{sma_period}"]
-            
-            chart_data.append(item)
-        
-        return clean_nan({"data": chart_data, "interval": config["interval"]})
+                raw = stock.history(period=config["fetch_period"], interval=config["interval"])
+            # SMAs are part of the cached frame, so cache hits skip them too
+            return chart_history(raw, config)
+        
+        # Blocking Yahoo download, run in a worker thread to keep the event loop free
+        history = await asyncio.to_thread(
+            cached_fetch,
+            chart_cache_key(ticker.upper(), config),
+            CHART_TTL.get(config["interval"], HISTORY_TTL),
+            load_history,
+            is_cacheable_fetch
+        )
+        
+        # Response object, so FastAPI skips jsonable_encoder
+        return ORJSONResponse(chart_payload(history, timeframe, config))
         
     except Exception as e:
         print(f"Error fetching chart data for {ticker} ({timeframe}): {e}")
@@ -1431,20 +1742,71 @@ async def get_chart(ticker: str, timeframe: str):
 
 @app.get("/api/stock/{ticker}")
 async def read_stock(ticker: str):
-    data = get_stock_data(ticker)
-    return clean_nan(data)
-
-@app.get("/api/evaluate_moat/{ticker}")
-async def evaluate_moat(ticker: str):
-    api_key = os.environ.get("GEMINI_API_KEY")
-    if not api_key:
-        raise HTTPException(status_code=500, detail="GEMINI_API_KEY not found in environment variables.")
+    # get_stock_data blocks on Yahoo, keep it off the event loop
+    data = await asyncio.to_thread(get_stock_data, ticker)
+    # Returned as a response object so FastAPI skips its jsonable_encoder pass.
+    # No NaN-cleaning pass: orjson writes NaN/Infinity as null while encoding
+    return ORJSONResponse(data)
+
+@app.post("/api/cache/invalidate/{ticker}")
+async def invalidate_cache(ticker: str, x_cache_admin_token: str = Header(default="")):
+    """
+    Drop all cached data for a ticker (fetched Yahoo data and per-day results).
+    Requires the X-Cache-Admin-Token header to match CACHE_ADMIN_TOKEN; without that
+    variable set the endpoint is disabled, since flushing moat results costs Gemini calls.
+    """
+    admin_token = os.environ.get("CACHE_ADMIN_TOKEN")
+    if not admin_token:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not hmac.compare_digest(x_cache_admin_token.encode(), admin_token.encode()):
+        raise HTTPException(status_code=403, detail="Invalid cache admin token.")
+
+    symbol = ticker.upper()
+    removed = cache_invalidate_ticker(symbol)
+    # Escape the symbol so a ticker like "*" can't match every other ticker's files
+    for path in MOAT_CACHE_DIR.glob(f"{glob.escape(symbol)}_*.json"):
+        path.unlink(missing_ok=True)
+        removed += 1
+    return {"ticker": symbol, "invalidated": removed}
+
+# Each ticker is analyzed by its own get_stock_data call (about a dozen Yahoo requests),
+# so groups bound how many analyses run at once and the cap bounds a request's total work
+BATCH_GROUP_SIZE = 10
+BATCH_MAX_TICKERS = 25
+
+@app.get("/api/stock/batch/{tickers}")
+async def read_stock_batch(tickers: str):
+    """
+    Analyze several comma-separated tickers (e.g. AAPL,MSFT,NVDA) in one request.
+    Each group of tickers is analyzed concurrently; a failed ticker reports its error
+    instead of failing the whole batch.
+    """
+    symbols = list(dict.fromkeys(t.strip().upper() for t in tickers.split(",") if t.strip()))
+    if not symbols:
+        raise HTTPException(status_code=400, detail="No tickers provided.")
+    if len(symbols) > BATCH_MAX_TICKERS:
+        raise HTTPException(status_code=400, detail=f"At most {BATCH_MAX_TICKERS} tickers per batch.")
+
+    results = {}
+    for i in range(0, len(symbols), BATCH_GROUP_SIZE):
+        group = symbols[i:i + BATCH_GROUP_SIZE]
+        outcomes = await asyncio.gather(
+            *(asyncio.to_thread(get_stock_data, symbol) for symbol in group),
+            return_exceptions=True
+        )
+        for symbol, outcome in zip(group, outcomes):
+            if isinstance(outcome, HTTPException):
+                results[symbol] = {"error": outcome.detail}
+            elif isinstance(outcome, Exception):
+                results[symbol] = {"error": str(outcome)}
+            else:
+                results[symbol] = outcome
+    return ORJSONResponse(results)
 
-    current_date = pd.Timestamp.now().strftime("%Y-%m-%d")
-    
-    prompt = f"""
+# Gemini moat prompt, filled in with str.format (literal braces are doubled)
+MOAT_PROMPT_TEMPLATE = """
     Evaluate the economic moat of the stock with code: {ticker}.
-    Current Date: {current_date}.
+    Current Date: {date}.
     Please evaluate based on the latest information available as of this date.
     
     Criteria to evaluate:
@@ -1467,49 +1829,187 @@ async def evaluate_moat(ticker: str):
       "description": "Your short explanation here"
     }}
     """
-    
-    payload = {
+MOAT_GENERATION_CONFIG = {"responseMimeType": "application/json"}
+# Tried in order, falling back to the next on failure
+GEMINI_MODELS = ["gemini-2.5-flash-lite", "gemini-2.5-flash"]
+
+# Keep-alive connections (over HTTP/2) are reused across requests instead of a new TLS
+# handshake per call
+GEMINI_CLIENT_OPTIONS = {"http2": True, "timeout": 30, "limits": httpx.Limits(max_keepalive_connections=20)}
+
+@contextlib.asynccontextmanager
+async def gemini_session():
+    """
+    The pooled client lifespan opened, when running on its loop. A pool is bound to the
+    loop that opened it, and the Vercel bridge (like TestClient outside `with`) runs
+    requests on fresh loops, so those get a client of their own, closed afterwards.
+    """
+    client = getattr(app.state, "gemini_client", None)
+    if client is not None and getattr(app.state, "gemini_loop", None) is asyncio.get_running_loop():
+        yield client
+        return
+    async with httpx.AsyncClient(**GEMINI_CLIENT_OPTIONS) as client:
+        yield client
+
+GEMINI_ATTEMPTS = 2    # Per model, for transient failures
+GEMINI_BACKOFF = 0.5   # Seconds before the first retry, doubled per retry up to 2s
+
+def is_transient(e):
+    """Rate limits, server errors, timeouts and connection failures are worth retrying"""
+    if isinstance(e, httpx.HTTPStatusError):
+        return e.response.status_code == 429 or e.response.status_code >= 500
+    return isinstance(e, httpx.TransportError)
+
+async def post_gemini(client, url, payload, api_key):
+    """POST to Gemini, retrying transient failures with exponential backoff"""
+    for attempt in range(GEMINI_ATTEMPTS):
+        try:
+            # Key sent as a header, so it never appears in error messages that quote the URL
+            response = await client.post(url, json=payload, headers={"x-goog-api-key": api_key})
+            response.raise_for_status()
+            return response
+        except httpx.HTTPError as e:
+            if not is_transient(e) or attempt == GEMINI_ATTEMPTS - 1:
+                raise
+            await asyncio.sleep(min(GEMINI_BACKOFF * 2 ** attempt, 2))
+
+def moat_payload(ticker, current_date):
+    """Gemini request body for a moat evaluation; only the prompt text changes between requests."""
+    prompt = MOAT_PROMPT_TEMPLATE.format(ticker=ticker, date=current_date)
+    return {
         "contents": [{
             "parts": [{"text": prompt}]
         }],
-        "generationConfig": {
-            "responseMimeType": "application/json"
-        }
+        "generationConfig": MOAT_GENERATION_CONFIG
     }
 
-    models_to_try = ["gemini-2.5-flash-lite", "gemini-2.5-flash"]
+def parse_moat_text(text):
+    # responseMimeType makes Gemini return bare JSON, so parse it directly
+    try:
+        return orjson.loads(text)
+    except orjson.JSONDecodeError:
+        # Clean up markdown if present anyway
+        text = text.replace("```json", "").replace("```", "").strip()
+        return json.loads(text)
+
+def stream_chunk_text(line):
+    """Text carried by one `data:` line of a streamGenerateContent SSE response ('' for anything else)."""
+    if not line.startswith("data:"):
+        return ""
+    chunk = orjson.loads(line[5:])
+    candidates = chunk.get("candidates") or [{}]
+    parts = candidates[0].get("content", {}).get("parts", [])
+    return "".join(part.get("text", "") for part in parts)
+
+def ndjson_line(obj):
+    return orjson.dumps(obj) + b"\n"
+
+@app.get("/api/evaluate_moat/{ticker}")
+async def evaluate_moat(ticker: str):
+    api_key = os.environ.get("GEMINI_API_KEY")
+    if not api_key:
+        raise HTTPException(status_code=500, detail="GEMINI_API_KEY not found in environment variables.")
+
+    symbol = ticker.upper()
+    current_date = pd.Timestamp.now().strftime("%Y-%m-%d")
+    cached = load_moat_evaluation(symbol, current_date)
+    if cached is not None:
+        return cached
+    
+    payload = moat_payload(ticker, current_date)
+
     last_exception = None
 
-    for model in models_to_try:
-        url = f"https://generativelanguage.googleapis.com/v1beta/models/{model}:generateContent?key={api_key}"
+    async with gemini_session() as client:
+        for model in GEMINI_MODELS:
+            url = f"https://generativelanguage.googleapis.com/v1beta/models/{model}:generateContent"
         
-        try:
-            response = requests.post(url, headers={"Content-Type": "application/json"}, json=payload, timeout=30)
-            response.raise_for_status()
-            result = response.json()
-            
-            # Extract text from response
             try:
-                if "candidates" not in result or not result["candidates"]:
-                     continue
-
-                text = result["candidates"][0]["content"]["parts"][0]["text"]
-                # Clean up markdown if present (though responseMimeType should handle it)
-                text = text.replace("```json", "").replace("```", "").strip()
-                return json.loads(text)
-            except (KeyError, IndexError, json.JSONDecodeError) as e:
-                print(f"Error parsing Gemini response from {model}: {e}")
-                last_exception = e
-                continue # Try next model if parsing fails
+                response = await post_gemini(client, url, payload, api_key)
+                result = response.json()
+            
+                # Extract text from response
+                try:
+                    if "candidates" not in result or not result["candidates"]:
+                         continue
+
+                    text = result["candidates"][0]["content"]["parts"][0]["text"]
+                    return store_moat_evaluation(symbol, current_date, parse_moat_text(text))
+                except (KeyError, IndexError, json.JSONDecodeError) as e:
+                    print(f"Error parsing Gemini response from {model}: {e}")
+                    last_exception = e
+                    continue # Try next model if parsing fails
                 
-        except requests.exceptions.RequestException as e:
-            print(f"Gemini API Error with {model}: {e}")
-            last_exception = e
-            continue # Try next model
+            except httpx.HTTPStatusError as e:
+                print(f"Gemini API Error with {model}: {e}")
+                if not is_transient(e):
+                    # A rejected key or request fails the same way on every model
+                    raise HTTPException(status_code=502, detail=f"Gemini rejected the request ({e.response.status_code}).")
+                last_exception = e
+                continue # Try next model
+            except (httpx.HTTPError, json.JSONDecodeError) as e:
+                print(f"Gemini API Error with {model}: {e}")
+                last_exception = e
+                continue # Try next model
 
     # If we get here, all models failed
     raise HTTPException(status_code=500, detail=f"All Gemini models failed. Last error: {str(last_exception)}")
 
+@app.get("/api/evaluate_moat/{ticker}/stream")
+async def evaluate_moat_stream(ticker: str):
+    """
+    Streaming variant of /api/evaluate_moat, sent as newline-delimited JSON:
+    {"text": ...} lines as Gemini writes the evaluation, then a final
+    {"evaluation": {...}} with the parsed result, or {"error": ...}.
+    """
+    api_key = os.environ.get("GEMINI_API_KEY")
+    if not api_key:
+        raise HTTPException(status_code=500, detail="GEMINI_API_KEY not found in environment variables.")
+
+    symbol = ticker.upper()
+    current_date = pd.Timestamp.now().strftime("%Y-%m-%d")
+    cached = load_moat_evaluation(symbol, current_date)
+    payload = moat_payload(ticker, current_date)
+
+    async def lines():
+        if cached is not None:
+            yield ndjson_line({"evaluation": cached})
+            return
+
+        last_exception = None
+        async with gemini_session() as client:
+            for model in GEMINI_MODELS:
+                url = f"https://generativelanguage.googleapis.com/v1beta/models/{model}:streamGenerateContent?alt=sse"
+                parts = []
+                try:
+                    async with client.stream("POST", url, json=payload, headers={"x-goog-api-key": api_key}) as response:
+                        response.raise_for_status()
+                        async for line in response.aiter_lines():
+                            text = stream_chunk_text(line)
+                            if text:
+                                parts.append(text)
+                                yield ndjson_line({"text": text})
+                    evaluation = parse_moat_text("".join(parts))
+                    yield ndjson_line({"evaluation": store_moat_evaluation(symbol, current_date, evaluation)})
+                    return
+                except httpx.HTTPStatusError as e:
+                    print(f"Gemini API Error with {model}: {e}")
+                    if not is_transient(e):
+                        yield ndjson_line({"error": f"Gemini rejected the request ({e.response.status_code})."})
+                        return
+                    last_exception = e
+                except (httpx.HTTPError, ValueError) as e:
+                    print(f"Gemini API Error with {model}: {e}")
+                    last_exception = e
+
+                if parts:
+                    # The client already has this model's partial text, switching models would garble it
+                    break
+
+        yield ndjson_line({"error": f"All Gemini models failed. Last error: {str(last_exception)}"})
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
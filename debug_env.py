@@ -1,10 +1,18 @@
 import os
+import functools
 from dotenv import load_dotenv
 
 # Explicitly specify path to .env to be sure
 dotenv_path = os.path.join(os.path.dirname(__file__), '.env')
-loaded = load_dotenv(dotenv_path)
 
-print(f"Dotenv loaded: {loaded}")
-print(f"Dotenv path: {dotenv_path}")
-print(f"GEMINI_API_KEY: {os.environ.get('GEMINI_API_KEY')}")
+@functools.lru_cache(maxsize=1)
+def load_env():
+    # Read .env once per process, however many times this is imported or called
+    return load_dotenv(dotenv_path)
+
+loaded = load_env()
+
+if __name__ == "__main__":
+    print(f"Dotenv loaded: {loaded}")
+    print(f"Dotenv path: {dotenv_path}")
+    print(f"GEMINI_API_KEY: {os.environ.get('GEMINI_API_KEY')}")
@@ -12,10 +12,25 @@ export const fetchStockData = async (ticker) => {
     }
 };
 
+// The chart endpoint responds column-wise ({interval, date: [...], close: [...], SMA_50: [...]}),
+// rebuild the per-point rows the charts consume, leaving out empty values
+const toChartRows = ({ interval, date = [], ...columns }) => {
+    const keys = Object.keys(columns);
+    const data = date.map((d, i) => {
+        const row = { date: d };
+        for (const key of keys) {
+            const value = columns[key][i];
+            if (value !== null && value !== undefined) row[key] = value;
+        }
+        return row;
+    });
+    return { data, interval };
+};
+
 export const fetchChartData = async (ticker, timeframe) => {
     try {
         const response = await axios.get(`${API_URL}/chart/${ticker}/${timeframe}`);
-        return response.data;
+        return toChartRows(response.data);
     } catch (error) {
         console.error("Error fetching chart data:", error);
         throw error;